@@ -0,0 +1,246 @@
+"""
+This module provides the operations of the batch (non-interactive) mode.
+Each job works on a single animation file and takes only picklable arguments, so that jobs can be spread over a pool
+of processes. The jobs that save files take the path of the animation file relative to the argument it was found from
+(relative_path, see expand_relative_paths(...)), so that directory trees are kept inside the output directory.
+"""
+
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from anim.bt3animation import Animation, load_animation, save_animation, read_animation_info, \
+    validate_animation_dump
+from anim.cache import AnimationCache
+from anim.paths import ANIMATION_FILE_EXTENSION
+from anim.patch import PATCH_FILE_EXTENSION, diff_animations, apply_patch
+from anim import instrumentation
+
+
+# The animations joined with or mixed into many others are loaded once for each worker process
+_donor_cache = AnimationCache()
+
+
+def _get_tree_file_path(file_path: str, dir_path: str, relative_path: str = None) -> str:
+    """
+    :return: the path of the file that corresponds to an animation file inside a directory tree (eg. its edited
+             version): relative_path (see get_save_file_path(...)) inside dir_path, or just the file name if None
+    """
+    return os.path.join(dir_path, *(relative_path or os.path.basename(file_path)).split("/"))
+
+
+def get_save_file_path(file_path: str, output_dir: str = None, relative_path: str = None) -> str:
+    """
+    Compute where to save an edited animation: just add "_save" before ".unk"
+    :param file_path: Original animation file path
+    :param output_dir: Destination directory. If None, the edited animation is saved next to the original
+    :param relative_path: Path of the original animation relative to the argument it was found from (see
+                          expand_relative_paths(...)), kept inside output_dir. If None, only the file name is kept
+    :return: the destination file path
+    """
+    if output_dir is not None:
+        file_path = _get_tree_file_path(file_path, output_dir, relative_path)
+    if file_path.endswith(ANIMATION_FILE_EXTENSION):
+        return file_path[:-len(ANIMATION_FILE_EXTENSION)] + "_save" + ANIMATION_FILE_EXTENSION
+    return file_path + "_save" + ANIMATION_FILE_EXTENSION
+
+
+def _save_animation(animation: Animation, file_path: str, output_dir: str = None, relative_path: str = None) -> str:
+    out_file_path = get_save_file_path(file_path, output_dir, relative_path)
+    if output_dir is not None:
+        os.makedirs(os.path.dirname(out_file_path), exist_ok=True)
+    save_animation(animation, out_file_path)
+    return out_file_path
+
+
+def info_job(file_path: str) -> str:
+    """
+    Describe an animation file (only its header is read)
+    """
+    info = read_animation_info(file_path)
+    return f"magic {info.get_magic()}, {info.get_frame_count()} frames, " \
+           f"{info.get_animated_bone_count()} animated bones, {info.get_size()} bytes"
+
+
+def validate_job(file_path: str) -> str:
+    """
+    Check the structure of an animation file (no keyframe is decoded)
+    """
+    with open(file_path, "rb") as file:
+        validate_animation_dump(file.read())
+    return "valid"
+
+
+def scale_job(file_path: str, new_frame_count: int, output_dir: str = None, interpolate: bool = False,
+              relative_path: str = None) -> str:
+    """
+    Change the frame count of an animation file and save it.
+    With interpolate, keyframes are resampled instead of just moved (see Animation.resample_frame_count(...)).
+    """
+    animation = load_animation(file_path)
+    old_frame_count = animation.get_frame_count()
+    if interpolate:
+        animation.resample_frame_count(new_frame_count)
+    else:
+        animation.scale_frame_count(new_frame_count)
+    out_file_path = _save_animation(animation, file_path, output_dir, relative_path)
+    return f"scaled from {old_frame_count} to {new_frame_count} frames -> {out_file_path}"
+
+
+def reduce_job(file_path: str, angular_tolerance: float = 0.0, positional_tolerance: float = 0.0,
+               output_dir: str = None, relative_path: str = None) -> str:
+    """
+    Drop the keyframes that can be interpolated from their neighbours (see Animation.reduce_keyframes(...)) and save
+    the animation
+    """
+    animation = load_animation(file_path)
+    old_keyframe_count = animation.get_keyframe_count()
+    saved = animation.reduce_keyframes(angular_tolerance, positional_tolerance)
+    out_file_path = _save_animation(animation, file_path, output_dir, relative_path)
+    return f"{old_keyframe_count - animation.get_keyframe_count()} keyframes dropped, {saved} bytes saved " \
+           f"-> {out_file_path}"
+
+
+def slice_job(file_path: str, start_frame: int, end_frame: int, output_dir: str = None,
+              relative_path: str = None) -> str:
+    """
+    Keep only a part of an animation file (see Animation.slice(...)) and save it
+    """
+    animation = load_animation(file_path).slice(start_frame, end_frame)
+    out_file_path = _save_animation(animation, file_path, output_dir, relative_path)
+    return f"frames {start_frame}-{end_frame} extracted, {animation.get_keyframe_count()} keyframes -> {out_file_path}"
+
+
+def concat_job(file_path: str, second_file_path: str, output_dir: str = None, blend_frames: int = 0,
+               relative_path: str = None) -> str:
+    """
+    Join an animation file with a second one (one after the other, with a crossfade of blend_frames frames) and save
+    it
+    """
+    animation = load_animation(file_path)
+    dropped = animation.concat(_donor_cache.get(second_file_path), blend_frames)
+    out_file_path = _save_animation(animation, file_path, output_dir, relative_path)
+    return f"{animation.get_frame_count()} frames, dropped bone animations {dropped} -> {out_file_path}"
+
+
+def chain_job(file_path: str, other_file_paths: list, out_file_path: str, blend_frames: int = 0) -> str:
+    """
+    Join an animation file with many others, one after the other (see Animation.concat_many(...)), and save the
+    result in out_file_path
+    """
+    animation = load_animation(file_path)
+    dropped = animation.concat_many(
+        [_donor_cache.get(other_file_path) for other_file_path in other_file_paths], blend_frames
+    )
+    save_animation(animation, out_file_path)
+    return f"{len(other_file_paths) + 1} animations joined, {animation.get_frame_count()} frames, " \
+           f"dropped bone animations {dropped} -> {out_file_path}"
+
+
+def mix_job(file_path: str, source_file_path: str, bone_list: list, output_dir: str = None,
+            relative_path: str = None) -> str:
+    """
+    Import some bone animations from source_file_path into an animation file and save it.
+    If the frame counts are different, the imported bone animations are scaled.
+    """
+    animation = load_animation(file_path)
+    source_animation = _donor_cache.get(source_file_path)
+    animation.import_bone_animations(source_animation=source_animation, bone_list=bone_list)
+    out_file_path = _save_animation(animation, file_path, output_dir, relative_path)
+    return f"imported bone animations {bone_list} -> {out_file_path}"
+
+
+def get_patch_file_path(file_path: str, patch_dir: str, relative_path: str = None) -> str:
+    """
+    :param file_path: Original animation file path
+    :param patch_dir: Directory of the patches
+    :param relative_path: Path of the original animation relative to the argument it was found from (see
+                          get_save_file_path(...)). If None, only the file name is kept
+    :return: the path of the patch of an animation file inside patch_dir (named after the animation file)
+    """
+    return _get_tree_file_path(file_path, patch_dir, relative_path) + PATCH_FILE_EXTENSION
+
+
+def diff_job(file_path: str, edited_dir: str, patch_dir: str, relative_path: str = None) -> str:
+    """
+    Compute the patch from an animation file to its edited version (the file with the same relative path inside
+    edited_dir, see diff_animations(...)) and save it inside patch_dir, with the same relative path
+    """
+    edited_file_path = _get_tree_file_path(file_path, edited_dir, relative_path)
+    patch = diff_animations(load_animation(file_path), load_animation(edited_file_path))
+    patch_file_path = get_patch_file_path(file_path, patch_dir, relative_path)
+    os.makedirs(os.path.dirname(patch_file_path), exist_ok=True)
+    with open(patch_file_path, "wb") as file:
+        file.write(patch)
+    return f"patch of {len(patch)} bytes ({os.path.getsize(edited_file_path)} bytes edited) -> {patch_file_path}"
+
+
+def patch_job(file_path: str, patch_dir: str, output_dir: str = None, relative_path: str = None) -> str:
+    """
+    Apply its patch (the one inside patch_dir with the same relative path, see apply_patch(...)) to an animation file
+    and save the result
+    """
+    with open(get_patch_file_path(file_path, patch_dir, relative_path), "rb") as file:
+        patch = file.read()
+    animation = apply_patch(load_animation(file_path), patch)
+    out_file_path = _save_animation(animation, file_path, output_dir, relative_path)
+    return f"patched, {animation.get_frame_count()} frames -> {out_file_path}"
+
+
+def _run_job(job, file_path: str, args: tuple, relative_path: str = None, instrumented: bool = False):
+    """
+    Run a job and catch its errors, so that a bad file doesn't stop the batch
+    :param relative_path: If not None, passed to job as relative_path
+    :param instrumented: If True, the instrumentation is enabled and the data it records during the job are returned
+                         (for jobs run in other processes)
+    :return: a (file path, result message, error message, instrumentation summary or None) tuple
+    """
+    if instrumented:
+        instrumentation.enable()
+        instrumentation.reset()
+    try:
+        kwargs = {} if relative_path is None else {"relative_path": relative_path}
+        message, error = job(file_path, *args, **kwargs), None
+    except Exception as e:
+        message, error = None, f"{type(e).__name__}: {e}"
+    return file_path, message, error, instrumentation.get_summary(None) if instrumented else None
+
+
+def run_jobs(job, file_paths: list, args: tuple = (), workers: int = None, progress=print,
+             relative_paths: dict = None) -> list:
+    """
+    Run job on every file, using a pool of processes
+    :param job: One of the *_job functions of this module. It's called as job(file_path, *args)
+    :param file_paths: Animation file paths
+    :param args: Other arguments of job
+    :param workers: Number of processes (None for one for each CPU). With 1 worker, jobs are run in this process.
+                    If the instrumentation is enabled, the data recorded by the other processes are collected.
+    :param progress: Function called with a message every time a job ends
+    :param relative_paths: File path -> path relative to the argument it was found from (see
+                           expand_relative_paths(...)), passed to job as relative_path. None for jobs that don't save
+                           files
+    :return: the list of the failed jobs as (file path, error message) tuples
+    """
+    errors = []
+
+    def report(done, result):
+        file_path, message, error, summary = result
+        if summary is not None:
+            instrumentation.merge_summary(summary)
+        if error is not None:
+            errors.append((file_path, error))
+            progress(f"[{done}/{len(file_paths)}] {file_path}: ERROR {error}")
+        else:
+            progress(f"[{done}/{len(file_paths)}] {file_path}: {message}")
+
+    if workers == 1:
+        for done, file_path in enumerate(file_paths, 1):
+            report(done, _run_job(job, file_path, args, None if relative_paths is None else relative_paths[file_path]))
+        return errors
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_job, job, file_path, args,
+                                   None if relative_paths is None else relative_paths[file_path],
+                                   instrumentation.ENABLED) for file_path in file_paths]
+        for done, future in enumerate(as_completed(futures), 1):
+            report(done, future.result())
+    return errors
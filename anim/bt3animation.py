@@ -3,37 +3,138 @@ This module provides classes that represent BT3 animations
 """
 
 
-import sys
+import os
 import copy
-import struct
+import hashlib
+import math
+from array import array
+from bisect import bisect_left, bisect_right
 from abc import ABC, abstractmethod
-from myutils.pack_and_unpack import *
+from myutils import codec
+from anim import instrumentation
+from anim.timestamps import scale_timestamps, offset_timestamps
+from anim.interpolation import locate, interpolate_rot_structs, interpolate_rotations, interpolate_translations, \
+    decode_rot_structs, encode_rotations, select_kept_keyframes
 
 
-class UnconcatenableAnimationsError(Exception):
+# Precompiled (little-endian) codecs used to decode the headers
+_BONE_HEADER_STRUCT = codec.get_struct("HH")  # Type, keyframe count
+_OFFSET_TABLE_STRUCT = codec.get_struct("HH" + "H" * 56)  # Magic, frame count, bone animation offsets (/ 4)
+
+# Layout of a keyframe type 0 (24 bytes): translation (3 floats), timestamp (uint32), rot_struct (8 bytes).
+# Whole blocks of keyframes are (de)interleaved through strided memoryviews: these are the positions of the fields,
+# expressed in items of the corresponding memoryview format. Memoryviews use the native byte order, so the columns
+# are converted from/to little-endian by codec (nothing is done on little-endian hosts).
+_KEYFRAME0_SIZE = 24
+_KEYFRAME0_FLOATS = 6  # _KEYFRAME0_SIZE / 4, translation x, y and z are the floats 0, 1, 2
+_KEYFRAME0_TIMESTAMP = 3  # Index of the timestamp among the 6 uint32
+_KEYFRAME0_ROT_STRUCT = 2  # Index of the rot_struct among the 3 uint64
+
+# Size of a rot_struct
+_ROT_STRUCT_SIZE = 8
+
+
+class AnimationError(Exception):
+    """
+    Base class of the errors raised by this module
+    """
+    pass
+
+
+class InvalidAnimationError(AnimationError):
+    """
+    The dump is not a valid animation (or bone animation)
+    """
+    pass
+
+
+class InvalidBoneIdError(AnimationError):
+    pass
+
+
+class UnconcatenableAnimationsError(AnimationError):
+    pass
+
+
+class InvalidFrameRangeError(AnimationError):
     pass
 
 
+class InvalidFrameCountError(AnimationError):
+    pass
+
+
+def make_bone_mask(bone_list) -> int:
+    """
+    :param bone_list: List of bones (IDs)
+    :return: the bone mask of the bones: an int where bit i is set if bone i is in bone_list
+    :raise InvalidBoneIdError: if bone_list contains an invalid bone ID
+    """
+    bone_mask = 0
+    for bone_id in bone_list:
+        if type(bone_id) != int or bone_id < 0 or bone_id >= Animation.BONE_COUNT:
+            raise InvalidBoneIdError(f"make_bone_mask(...) -> Error: invalid bone_id ({bone_id})")
+        bone_mask |= 1 << bone_id
+    return bone_mask
+
+
+def get_bone_mask_bones(bone_mask: int) -> list:
+    """
+    :param bone_mask: Bone mask (see make_bone_mask(...))
+    :return: the list of the bones (IDs) in the bone mask, in ascending order
+    """
+    return [bone_id for bone_id in range(bone_mask.bit_length()) if bone_mask >> bone_id & 1]
+
+
+def _get_bone_dump_size(bone_type: int, keyframe_count: int) -> int:
+    """
+    :return: the size of the BT3's binary form of a bone animation
+    """
+    if bone_type == 1:
+        # rot_structs, then timestamps (uint16) padded to a multiple of 4 bytes
+        return _BONE_HEADER_STRUCT.size + _ROT_STRUCT_SIZE * keyframe_count + (2 * keyframe_count + 3) // 4 * 4
+    return _BONE_HEADER_STRUCT.size + _KEYFRAME0_SIZE * keyframe_count
+
+
+def _offset_keyframe_ranges(keyframe_ranges: list, offsets: list) -> list:
+    """
+    Add an offset to the timestamps of many keyframe ranges (see BoneAnimation._get_keyframe_range(...)) at once
+    :param keyframe_ranges: List of (timestamps, translations, rot_structs) tuples
+    :param offsets: Timestamp offset of each keyframe range
+    :return: the keyframe ranges with the new timestamps
+    """
+    shifted_timestamps = offset_timestamps([timestamps for timestamps, _, _ in keyframe_ranges], offsets)
+    return [(timestamps, translations, rot_structs)
+            for timestamps, (_, translations, rot_structs) in zip(shifted_timestamps, keyframe_ranges)]
+
+
 class Keyframe(ABC):
     """
-    Just an abstract class for keyframes
+    Just an abstract class for keyframes.
+    Keyframes are not stored as objects: they are lightweight views on the arrays of a BoneAnimation, so reading or
+    changing a keyframe reads or changes the BoneAnimation.
     """
 
-    @abstractmethod
-    def get_rot_struct(self):
-        pass
+    __slots__ = ("_bone_animation", "_index")
 
-    @abstractmethod
-    def get_timestamp(self):
-        pass
+    def __init__(self, bone_animation: "BoneAnimation", index: int):
+        self._bone_animation = bone_animation
+        self._index = index
+
+    def get_rot_struct(self) -> bytes:
+        cursor = self._index * _ROT_STRUCT_SIZE
+        return bytes(self._bone_animation._rot_structs[cursor:cursor + _ROT_STRUCT_SIZE])
+
+    def get_timestamp(self) -> int:
+        return self._bone_animation._timestamps[self._index]
 
     @abstractmethod
     def get_translation(self):
         pass
 
-    @abstractmethod
     def set_timestamp(self, new_timestamp):
-        pass
+        self._bone_animation._modify()
+        self._bone_animation._timestamps[self._index] = new_timestamp
 
 
 class KeyframeType1(Keyframe):
@@ -41,90 +142,147 @@ class KeyframeType1(Keyframe):
     Real implementation for keyframes type 1
     """
 
-    def __init__(self, rot_struct, timestamp):
-        self.rot_struct = rot_struct
-        self.timestamp = timestamp
-
-    def get_rot_struct(self):
-        return self.rot_struct
-
-    def get_timestamp(self):
-        return self.timestamp
+    __slots__ = ()
 
     def get_translation(self):
         print("KeyframeType1 -> get_translation(...) -> Error: KeyframeType1 instances have no translations")
         return 0, 0, 0
 
-    def set_timestamp(self, new_timestamp):
-        self.timestamp = new_timestamp
-
 
 class KeyframeType0(Keyframe):
     """
-    Real implementation for keyframes type 1
+    Real implementation for keyframes type 0
     """
 
-    def __init__(self, translation, rot_struct, timestamp):
-        self.translation = translation
-        self.rot_struct = rot_struct
-        self.timestamp = timestamp
-
-    def get_rot_struct(self):
-        return self.rot_struct
-
-    def get_timestamp(self):
-        return self.timestamp
+    __slots__ = ()
 
     def get_translation(self):
-        return self.translation
-
-    def set_timestamp(self, new_timestamp):
-        self.timestamp = new_timestamp
+        cursor = self._index * 3
+        return tuple(self._bone_animation._translations[cursor:cursor + 3])
 
 
 class BoneAnimation:
     """
     An instance of this class represent an animation for a single bone (eg. the animation of Goku's tail during the
-    stance in Character Reference)
+    stance in Character Reference).
+    Keyframes are stored by column: timestamps and translations (x, y, z for each keyframe) are kept in typed arrays,
+    rot_structs in a single contiguous bytearray (8 bytes for each keyframe).
+    Keyframes are decoded only when they are accessed for the first time.
+    The binary form is cached: at first it's the original one (a view on the animation file dump), then the last one
+    computed by dump(). Every change invalidates it, so dump() encodes only the bone animations changed since the
+    previous dump().
     """
 
-    def __init__(self, dump: bytes):
+    def __init__(self, dump: bytes, offset: int = 0):
+        """
+        Constructor
+        :param dump: Buffer containing the bone animation (bytes, bytearray or memoryview). It can be the dump of the
+                     whole animation file: no copy of it is made
+        :param offset: Offset of the bone animation inside dump
+        """
+        dump = memoryview(dump)
+        if offset < 0 or offset + _BONE_HEADER_STRUCT.size > len(dump):
+            raise InvalidAnimationError(f"BoneAnimation -> __init__(...) -> Error: offset {offset} out of the dump")
+
         # Check type. It can be 0 or 1.
         # 0 is for keyframe with rotations and positions, 1 is for keyframe with only rotations
-        self._type = up16(dump[0:2])
+        # Keyframe count. It has to be equal or less than the number of the frame of the animation.
+        self._type, self._keyframe_count = _BONE_HEADER_STRUCT.unpack_from(dump, offset)
         if self._type != 0 and self._type != 1:
-            print("BoneAnimation -> __init__(...) -> Error: invalid dump (1)")
-            sys.exit(1)
+            raise InvalidAnimationError(f"BoneAnimation -> __init__(...) -> Error: invalid type ({self._type})")
 
-        # Keyframe count. It has to be equal or less than the number of the frame of the animation.
-        self._keyframe_count = up16(dump[2:4])
+        # Keyframe arrays (built by _decode())
+        self._timestamps = None
+        self._translations = None
+        self._rot_structs = None
+
+        # Decoded rotations used by sample(...) (built at the first sampling, dropped at every change)
+        self._rotations = None
+
+        # Content hash of the binary form (computed by digest(), dropped at every change)
+        self._digest = None
 
-        # Build the keyframe list
-        self._keyframe_list = []
+        # Cached binary form (None if it has to be computed again). At first it's a view on dump (no copies).
+        self._encoded = dump[offset:offset + self.get_dump_size()]
+        self._modified = False
+        if len(self._encoded) != self.get_dump_size():
+            raise InvalidAnimationError(
+                f"BoneAnimation -> __init__(...) -> Error: {self._keyframe_count} keyframes don't fit in the dump"
+            )
+
+    def _decode(self):
+        """
+        Build the keyframe arrays from the original binary form (if not already done)
+        """
+        if self._timestamps is not None:
+            return
+
+        self._timestamps, self._translations, self._rot_structs = self._decode_range(0, self._keyframe_count)
+
+    @instrumentation.timed("decode")
+    def _decode_range(self, first: int, last: int) -> tuple:
+        """
+        Decode some keyframes from the original binary form, without building the keyframe arrays
+        :return: the keyframes from first to last (excluded) as new (timestamps, translations, rot_structs) arrays
+        """
+        cursor = _BONE_HEADER_STRUCT.size
+        timestamps = array("I")
+        translations = array("f")
         if self._type == 1:
-            for i in range(self._keyframe_count):
-                cursor = 4 + i * 8
-                timestamp_cursor = 4 + 8 * self._keyframe_count + i * 2
-                self._keyframe_list.append(KeyframeType1(
-                    rot_struct=dump[cursor:cursor+8],
-                    timestamp=up16(dump[timestamp_cursor:timestamp_cursor+2])
-                ))
-        elif self._type == 0:
-            for i in range(self._keyframe_count):
-                cursor = 4 + i * 24
-                self._keyframe_list.append(KeyframeType0(
-                    translation=struct.unpack("fff", dump[cursor:cursor + 12]),
-                    timestamp=up32(dump[cursor+12:cursor+12+4]),
-                    rot_struct=dump[cursor+16:cursor+16+8]
-                ))
+            rot_structs_end = cursor + _ROT_STRUCT_SIZE * self._keyframe_count
+            rot_structs = bytearray(self._encoded[cursor + _ROT_STRUCT_SIZE * first:cursor + _ROT_STRUCT_SIZE * last])
+            timestamps = array("I", codec.unpack_many(
+                "H", self._encoded[rot_structs_end + 2 * first:rot_structs_end + 2 * last]
+            ))
+        else:
+            block = self._encoded[cursor + _KEYFRAME0_SIZE * first:cursor + _KEYFRAME0_SIZE * last]
+            rot_structs = bytearray(block.cast("Q")[_KEYFRAME0_ROT_STRUCT::3])
+            timestamps.frombytes(block.cast("I")[_KEYFRAME0_TIMESTAMP::_KEYFRAME0_FLOATS].tobytes())
+            translations.frombytes(bytes(12 * (last - first)))
+            floats = block.cast("f")
+            translations_view = memoryview(translations)
+            for axis in range(3):
+                translations_view[axis::3] = floats[axis::_KEYFRAME0_FLOATS]
+            codec.from_little_endian(timestamps)
+            codec.from_little_endian(translations)
+
+        if instrumentation.ENABLED:
+            instrumentation.count("keyframes_decoded", last - first)
+        return timestamps, translations, rot_structs
+
+    def _get_timestamp_view(self):
+        """
+        :return: the timestamps of the keyframes, without decoding them: if the keyframe arrays have not been built, a
+                 view on the original binary form (good for binary searches)
+        """
+        # The view would be in the wrong byte order
+        if not codec.NATIVE_LITTLE_ENDIAN:
+            self._decode()
+        if self._timestamps is not None:
+            return self._timestamps
 
-    def __sum_timestamp_offset(self, offset: int):
+        cursor = _BONE_HEADER_STRUCT.size
+        if self._type == 1:
+            timestamps_start = cursor + _ROT_STRUCT_SIZE * self._keyframe_count
+            return self._encoded[timestamps_start:timestamps_start + 2 * self._keyframe_count].cast("H")
+        block = self._encoded[cursor:cursor + _KEYFRAME0_SIZE * self._keyframe_count]
+        return block.cast("I")[_KEYFRAME0_TIMESTAMP::_KEYFRAME0_FLOATS]
+
+    def _modify(self):
+        """
+        Must be called before changing the keyframe arrays: the cached binary form is not valid anymore
+        """
+        self._decode()
+        self._encoded = None
+        self._rotations = None
+        self._digest = None
+        self._modified = True
+
+    def is_modified(self) -> bool:
         """
-        Each timestamp is incremented by offset
-        :param offset: Timestamp offset
+        :return: True if the bone animation has been changed after its creation
         """
-        for keyframe in self._keyframe_list:
-            keyframe.set_timestamp(keyframe.get_timestamp() + offset)
+        return self._modified
 
     def scale_timestamps_according_to_frame_count(self, old_frame_count, new_frame_count):
         """
@@ -136,12 +294,145 @@ class BoneAnimation:
         if old_frame_count == new_frame_count:
             return
 
-        for keyframe in self._keyframe_list:
-            keyframe.set_timestamp(round(keyframe.get_timestamp() / old_frame_count * new_frame_count))
+        self._modify()
+        self._timestamps = scale_timestamps([self._timestamps], old_frame_count, new_frame_count)[0]
+
+    def resample_timestamps_according_to_frame_count(self, old_frame_count, new_frame_count):
+        """
+        Like scale_timestamps_according_to_frame_count(...), but keyframes are not just moved and rounded: each new
+        keyframe is computed by sampling the animation (slerp for rotations, lerp for translations) at the exact time
+        that its (integer) frame corresponds to. Keyframes that would land on the same frame are merged into one.
+        :param old_frame_count: Old frame count (needed to perform computations)
+        :param new_frame_count: New frame count
+        """
+        if old_frame_count == new_frame_count:
+            return
+
+        self._modify()
+        frames = sorted(set(scale_timestamps([self._timestamps], old_frame_count, new_frame_count)[0]))
+        indices, weights = locate(self._timestamps, [frame * old_frame_count / new_frame_count for frame in frames])
+        self._rot_structs = interpolate_rot_structs(self._rot_structs, indices, weights)
+        if self._type == 0:
+            self._translations = interpolate_translations(self._translations, indices, weights)
+        self._timestamps = array("I", frames)
+
+    def reduce_keyframes(self, angular_tolerance: float = 0.0, positional_tolerance: float = 0.0) -> int:
+        """
+        Drop the keyframes that can be computed by interpolating the kept ones around them (slerp for rotations, lerp
+        for translations, see interpolation.select_kept_keyframes(...)). The first and the last keyframes are always
+        kept.
+        With the default tolerances, only exact matches are dropped (eg. the middle keyframes of a run of identical
+        keyframes).
+        :param angular_tolerance: Maximum rotation error (radians)
+        :param positional_tolerance: Maximum translation error (distance)
+        :return: the number of bytes saved
+        """
+        keyframe_count = self.get_keyframe_count()
+        if keyframe_count <= 2:
+            return 0
+
+        self._decode()
+        kept = select_kept_keyframes(self._timestamps, self._rot_structs,
+                                     self._translations if self._type == 0 else None, angular_tolerance,
+                                     positional_tolerance)
+        if len(kept) == keyframe_count:
+            return 0
+
+        old_dump_size = self.get_dump_size()
+        self._modify()
+        self._timestamps = array("I", [self._timestamps[i] for i in kept])
+        self._rot_structs = bytearray().join(
+            [self._rot_structs[i * _ROT_STRUCT_SIZE:(i + 1) * _ROT_STRUCT_SIZE] for i in kept]
+        )
+        if self._type == 0:
+            translations = array("f")
+            for i in kept:
+                translations.extend(self._translations[i * 3:i * 3 + 3])
+            self._translations = translations
+        return old_dump_size - self.get_dump_size()
 
     def get_type(self) -> int:
         return self._type
 
+    def copy(self) -> "BoneAnimation":
+        """
+        :return: an independent copy of this BoneAnimation. The original binary form (if still valid) is shared, not
+                 copied, since it's never changed
+        """
+        bone_animation = copy.copy(self)
+        if self._timestamps is not None:
+            bone_animation._timestamps = array("I", self._timestamps)
+            bone_animation._translations = array("f", self._translations)
+            bone_animation._rot_structs = bytearray(self._rot_structs)
+        return bone_animation
+
+    def get_keyframe_count(self) -> int:
+        if self._timestamps is None:
+            return self._keyframe_count
+        return len(self._timestamps)
+
+    def get_keyframe(self, index: int) -> Keyframe:
+        """
+        :return: a view on the keyframe number index
+        """
+        if index < 0 or index >= self.get_keyframe_count():
+            raise IndexError(f"BoneAnimation -> get_keyframe(...) -> Error: invalid index ({index})")
+        self._decode()
+        if self._type == 1:
+            return KeyframeType1(self, index)
+        return KeyframeType0(self, index)
+
+    def get_keyframes(self) -> list:
+        """
+        :return: a list of views on all the keyframes
+        """
+        return [self.get_keyframe(i) for i in range(self.get_keyframe_count())]
+
+    def copy_timestamps(self) -> array:
+        """
+        :return: a copy of the timestamps of the keyframes
+        """
+        return array("I", self._get_timestamp_view())
+
+    def set_timestamps(self, timestamps):
+        """
+        Replace the timestamps of the keyframes (rotations and translations are kept)
+        :param timestamps: The new timestamps, one for each keyframe
+        :raise InvalidAnimationError: if the number of timestamps is not the keyframe count
+        """
+        if len(timestamps) != self.get_keyframe_count():
+            raise InvalidAnimationError(
+                f"BoneAnimation -> set_timestamps(...) -> Error: {len(timestamps)} timestamps for "
+                f"{self.get_keyframe_count()} keyframes"
+            )
+        self._modify()
+        self._timestamps = array("I", timestamps)
+
+    def sample(self, times) -> list:
+        """
+        Compute the state of the bone at some times, interpolating the keyframes around them (slerp for rotations, lerp
+        for translations). Before the first keyframe and after the last one, the state is the one of that keyframe.
+        Keyframes are found by binary search, and the decoded rotations are kept until the bone animation is changed,
+        so sampling the same bone animation many times is cheap.
+        :param times: List of times (frames, they don't need to be integers)
+        :return: for each time, a (rotation, translation) tuple: rotation is a (x, y, z, w) quaternion (see
+                 interpolation.decode_rot_structs(...)), translation is a (x, y, z) tuple (None for type 1). None for
+                 each time if there are no keyframes.
+        """
+        if self.get_keyframe_count() == 0:
+            return [None] * len(times)
+
+        self._decode()
+        if self._rotations is None:
+            self._rotations = decode_rot_structs(self._rot_structs)
+
+        indices, weights = locate(self._timestamps, times)
+        rotations = interpolate_rotations(self._rotations, indices, weights)
+        if self._type == 1:
+            return [(rotation, None) for rotation in rotations]
+        translations = interpolate_translations(self._translations, indices, weights)
+        return [(rotation, tuple(translations[i * 3:i * 3 + 3])) for i, rotation in enumerate(rotations)]
+
     def concat(self, old_frame_count: int, source_bone_animation: "BoneAnimation"):
         """
         Concat self with source_animation.
@@ -151,38 +442,189 @@ class BoneAnimation:
         :param source_bone_animation: The animation to append at the "end" of self
         """
         assert self._type == source_bone_animation._type
-        source_bone_animation = copy.deepcopy(source_bone_animation)
-        source_bone_animation.__sum_timestamp_offset(old_frame_count + 1)
-        self._keyframe_list += source_bone_animation._keyframe_list
-        self._keyframe_count = len(self._keyframe_list)
+        source_bone_animation._decode()
+        source_timestamps = offset_timestamps([source_bone_animation._timestamps], old_frame_count + 1)
+        self._append([source_bone_animation], source_timestamps)
 
-    def dump(self) -> bytes:
+    def _append(self, source_bone_animations: list, source_timestamps: list):
+        """
+        Append the keyframes of some bone animations (already decoded) to self, with new timestamps.
+        The new keyframe arrays are built in a single pass (the same bone animation can appear more than once, self
+        included).
+        :param source_bone_animations: The bone animations whose keyframes are appended (in order)
+        :param source_timestamps: The timestamps to use for each of them
         """
-        Compute and return the BT3's binary form of this Animation as bytes
+        self._modify()
+        timestamps = array("I", self._timestamps)
+        translations = array("f", self._translations)
+        rot_structs = [self._rot_structs]
+        for source_bone_animation, source_bone_timestamps in zip(source_bone_animations, source_timestamps):
+            assert self._type == source_bone_animation._type
+            timestamps.extend(source_bone_timestamps)
+            translations.extend(source_bone_animation._translations)
+            rot_structs.append(source_bone_animation._rot_structs)
+        self._timestamps = timestamps
+        self._translations = translations
+        self._rot_structs = bytearray().join(rot_structs)
+
+    def _get_keyframe_range(self, first: int, last: int) -> tuple:
         """
+        :return: the keyframes from first to last (excluded) as new (timestamps, translations, rot_structs) arrays
+        """
+        # Only the requested keyframes are decoded
+        if self._timestamps is None:
+            return self._decode_range(first, last)
+        return (self._timestamps[first:last], self._translations[first * 3:last * 3],
+                self._rot_structs[first * _ROT_STRUCT_SIZE:last * _ROT_STRUCT_SIZE])
+
+    def _set_keyframes(self, keyframe_ranges: list):
+        """
+        Replace all the keyframes of self with the ones of some keyframe ranges, joined in order
+        :param keyframe_ranges: List of (timestamps, translations, rot_structs) tuples (see _get_keyframe_range(...))
+        """
+        timestamps = array("I")
+        translations = array("f")
+        for range_timestamps, range_translations, _ in keyframe_ranges:
+            timestamps.extend(range_timestamps)
+            translations.extend(range_translations)
+        self._timestamps = timestamps
+        self._translations = translations
+        self._rot_structs = bytearray().join(rot_structs for _, _, rot_structs in keyframe_ranges)
+        self._modify()
+
+    def _get_interpolated_keyframe(self, time: int) -> tuple:
+        """
+        :return: the keyframe at time, interpolating the keyframes around it (only them are decoded), as a keyframe
+                 range (see _get_keyframe_range(...))
+        """
+        timestamps = self._get_timestamp_view()
+        i = bisect_right(timestamps, time)
+        range_timestamps, range_translations, range_rot_structs = self._get_keyframe_range(
+            max(i - 1, 0), min(i + 1, len(timestamps))
+        )
+        indices, weights = locate(range_timestamps, [time])
+        if self._type == 0:
+            range_translations = interpolate_translations(range_translations, indices, weights)
+        return array("I", [time]), range_translations, interpolate_rot_structs(range_rot_structs, indices, weights)
+
+    def _get_time_range(self, start: int, end: int = None) -> list:
+        """
+        Get the keyframes from time start to time end (included), found by binary search. Only them are decoded.
+        If there is no keyframe exactly at start or at end, one is interpolated from the keyframes around it.
+        :param start: Start time
+        :param end: End time (None to get all the keyframes after start)
+        :return: list of keyframe ranges (see _get_keyframe_range(...)), with the original timestamps
+        """
+        timestamps = self._get_timestamp_view()
+        if len(timestamps) == 0:
+            return []
+
+        first = bisect_left(timestamps, start)
+        last = len(timestamps) if end is None else bisect_right(timestamps, end)
+        keyframe_ranges = []
+        if first == len(timestamps) or timestamps[first] != start:
+            keyframe_ranges.append(self._get_interpolated_keyframe(start))
+        keyframe_ranges.append(self._get_keyframe_range(first, last))
+        if end is not None and end != start and (last == 0 or timestamps[last - 1] != end):
+            keyframe_ranges.append(self._get_interpolated_keyframe(end))
+        return keyframe_ranges
+
+    def slice(self, start_frame: int, end_frame: int) -> "BoneAnimation":
+        """
+        :param start_frame: First frame
+        :param end_frame: Last frame (included)
+        :return: a new BoneAnimation with the keyframes from start_frame to end_frame, moved to start from frame 0
+                 (see Animation.slice(...))
+        """
+        keyframe_ranges = self._get_time_range(start_frame, end_frame)
+        bone_animation = copy.copy(self)
+        bone_animation._set_keyframes(_offset_keyframe_ranges(keyframe_ranges, [-start_frame] * len(keyframe_ranges)))
+        return bone_animation
 
+    def get_dump_size(self) -> int:
+        """
+        :return: the size of the BT3's binary form of this BoneAnimation (the length of dump()), computed without
+                 dumping it
+        """
+        return _get_bone_dump_size(self._type, self.get_keyframe_count())
+
+    @instrumentation.timed("encode")
+    def _encode(self) -> bytearray:
+        """
+        Compute the BT3's binary form of this BoneAnimation from the keyframe arrays
+        """
         if self._type != 0 and self._type != 1:
-            print("BoneAnimation -> dump(...) -> Error: invalid self._type")
-            sys.exit(1)
+            raise InvalidAnimationError(f"BoneAnimation -> dump(...) -> Error: invalid type ({self._type})")
 
-        dump = p16(self._type) + p16(self._keyframe_count)
+        keyframe_count = len(self._timestamps)
+        encoded = bytearray(self.get_dump_size())
+        _BONE_HEADER_STRUCT.pack_into(encoded, 0, self._type, keyframe_count)
+        cursor = _BONE_HEADER_STRUCT.size
         if self._type == 1:
-            timestamp_dump = b""
-            for keyframe in self._keyframe_list:
-                dump += keyframe.get_rot_struct()
-                timestamp_dump += p16(keyframe.get_timestamp())
-            if len(timestamp_dump) % 4 != 0:
-                timestamp_dump += p16(0)
-            dump += timestamp_dump
+            timestamps_start = cursor + _ROT_STRUCT_SIZE * keyframe_count
+            encoded[cursor:timestamps_start] = self._rot_structs
+            encoded[timestamps_start:timestamps_start + 2 * keyframe_count] = codec.pack_many("H", self._timestamps)
         else:
-            for keyframe in self._keyframe_list:
-                dump += p_float(keyframe.get_translation()[0])
-                dump += p_float(keyframe.get_translation()[1])
-                dump += p_float(keyframe.get_translation()[2])
-                dump += p32(keyframe.get_timestamp())
-                dump += keyframe.get_rot_struct()
+            # Interleave the columns directly into the destination buffer
+            block = memoryview(encoded)[cursor:cursor + _KEYFRAME0_SIZE * keyframe_count]
+            floats = block.cast("f")
+            translations = memoryview(codec.to_little_endian(self._translations))
+            for axis in range(3):
+                floats[axis::_KEYFRAME0_FLOATS] = translations[axis::3]
+            timestamps = memoryview(codec.to_little_endian(self._timestamps))
+            block.cast("I")[_KEYFRAME0_TIMESTAMP::_KEYFRAME0_FLOATS] = timestamps
+            block.cast("Q")[_KEYFRAME0_ROT_STRUCT::3] = memoryview(self._rot_structs).cast("Q")
+
+        if instrumentation.ENABLED:
+            instrumentation.count("keyframes_encoded", keyframe_count)
+            instrumentation.count("bytes_encoded", len(encoded))
+        return encoded
+
+    def _get_encoded(self, cache: bool = True):
+        """
+        :param cache: If False and the binary form has to be computed, it's not cached (so it's freed as soon as the
+                      caller doesn't need it anymore)
+        :return: the cached BT3's binary form of this BoneAnimation (computed if needed). It can be a memoryview: it
+                 must not be changed
+        """
+        if self._encoded is not None:
+            return self._encoded
+        encoded = self._encode()
+        if cache:
+            self._encoded = encoded
+        return encoded
 
-        return dump
+    def dump(self) -> bytes:
+        """
+        Compute and return the BT3's binary form of this BoneAnimation as bytes
+        """
+        return bytes(self._get_encoded())
+
+    def digest(self) -> str:
+        """
+        :return: the content hash (SHA-256, hexadecimal) of the BT3's binary form of this BoneAnimation: bone
+                 animations with the same digest are byte-identical. It's computed once, until the next change
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha256(self._get_encoded()).hexdigest()
+        return self._digest
+
+
+def _scale_bone_animations(bone_animations: list, old_frame_count: int, new_frame_count: int):
+    """
+    Like BoneAnimation.scale_timestamps_according_to_frame_count(...), but the timestamps of all the bone animations
+    (None items are skipped) are scaled together
+    """
+    bone_animations = [bone_animation for bone_animation in bone_animations if bone_animation is not None]
+    if len(bone_animations) == 0:
+        return
+    for bone_animation in bone_animations:
+        bone_animation._modify()
+    scaled_timestamps = scale_timestamps(
+        [bone_animation._timestamps for bone_animation in bone_animations], old_frame_count, new_frame_count
+    )
+    for bone_animation, timestamps in zip(bone_animations, scaled_timestamps):
+        bone_animation._timestamps = timestamps
 
 
 class Animation:
@@ -192,37 +634,92 @@ class Animation:
 
     BONE_COUNT = 56
 
+    @instrumentation.timed("parse")
     def __init__(self, dump: bytes):
         """
         Constructor
         :param dump: Animation file dump (bytes)
         """
-        if len(dump) < 110:
-            print("Animation -> __init__(...) -> Error: invalid dump (1)")
-            sys.exit(1)
+        if len(dump) < _OFFSET_TABLE_STRUCT.size:
+            raise InvalidAnimationError(f"Animation -> __init__(...) -> Error: dump too short ({len(dump)} bytes)")
 
-        # "Magic" and frame count
-        self._magic = up16(dump[0:2])
-        self._frame_count = up16(dump[2:4])
+        # "Magic", frame count and divisions offsets
+        self._magic, self._frame_count, *division_offsets = _OFFSET_TABLE_STRUCT.unpack_from(dump)
 
-        # Divisions
+        # Divisions. The dump is shared among all the bone animations (no copies).
+        dump_view = memoryview(dump)
         first_division_start_offset = None
         self._bone_animations = []
-        for i in range(Animation.BONE_COUNT):
-            division_start_offset = up16(dump[4 + i * 2:6 + i * 2]) * 4
+        for division_offset in division_offsets:
+            division_start_offset = division_offset * 4
             if division_start_offset == 0:
                 self._bone_animations.append(None)
                 continue
-            self._bone_animations.append(BoneAnimation(dump[division_start_offset:]))
+            if division_start_offset < _OFFSET_TABLE_STRUCT.size:
+                raise InvalidAnimationError(
+                    f"Animation -> __init__(...) -> Error: bone animation {len(self._bone_animations)} overlaps the "
+                    f"header"
+                )
+            self._bone_animations.append(BoneAnimation(dump_view, division_start_offset))
             if first_division_start_offset is None:
                 first_division_start_offset = division_start_offset
 
         if first_division_start_offset is None:
-            print("Animation -> __init__(...) -> Error: invalid dump (2)")
-            sys.exit(1)
+            raise InvalidAnimationError("Animation -> __init__(...) -> Error: no animated bones")
 
         # Other header info
-        self._header_rem = dump[4 + Animation.BONE_COUNT * 2:first_division_start_offset]
+        self._header_rem = bytes(dump_view[_OFFSET_TABLE_STRUCT.size:first_division_start_offset])
+
+        if instrumentation.ENABLED:
+            instrumentation.count("animations_parsed")
+            instrumentation.count("bytes_parsed", len(dump))
+
+    @staticmethod
+    def from_bone_segments(magic: int, frame_count: int, header_rem: bytes, bone_segments: list) -> "Animation":
+        """
+        Build an Animation from its parts, without an animation file dump
+        :param magic: "Magic" number
+        :param frame_count: Frame count
+        :param header_rem: Other header info (between the offset table and the first bone animation)
+        :param bone_segments: The BT3's binary form of each bone animation (None for bones that are not animated). They
+                              are shared, not copied (see BoneAnimation.__init__(...))
+        :return: the new Animation
+        :raise InvalidAnimationError: if there are no animated bones, or a segment is not a valid bone animation
+        """
+        if len(bone_segments) != Animation.BONE_COUNT:
+            raise InvalidAnimationError("Animation -> from_bone_segments(...) -> Error: wrong number of bones")
+        return Animation.from_bone_animations(
+            magic, frame_count, header_rem,
+            [None if segment is None else BoneAnimation(segment) for segment in bone_segments]
+        )
+
+    @staticmethod
+    def from_bone_animations(magic: int, frame_count: int, header_rem: bytes, bone_animations: list) -> "Animation":
+        """
+        Build an Animation from its parts (see from_bone_segments(...))
+        :param bone_animations: The BoneAnimation of each bone (None for bones that are not animated). They are used
+                                as they are, not copied
+        :return: the new Animation
+        :raise InvalidAnimationError: if there are no animated bones
+        """
+        if len(bone_animations) != Animation.BONE_COUNT or all(bone is None for bone in bone_animations):
+            raise InvalidAnimationError("Animation -> from_bone_animations(...) -> Error: no animated bones")
+
+        animation = Animation.__new__(Animation)
+        animation._magic = magic
+        animation._frame_count = frame_count
+        animation._header_rem = bytes(header_rem)
+        animation._bone_animations = list(bone_animations)
+        return animation
+
+    def copy(self) -> "Animation":
+        """
+        :return: an independent copy of this Animation (see BoneAnimation.copy())
+        """
+        animation = copy.copy(self)
+        animation._bone_animations = [None if bone_animation is None else bone_animation.copy()
+                                      for bone_animation in self._bone_animations]
+        return animation
 
     def get_magic(self) -> int:
         return self._magic
@@ -233,6 +730,18 @@ class Animation:
         """
         return self._frame_count
 
+    def get_header_rem(self) -> bytes:
+        """
+        :return: the other header info (between the offset table and the first bone animation)
+        """
+        return self._header_rem
+
+    def get_bone_animations(self) -> list:
+        """
+        :return: the bone animations (None for bones that are not animated). They are not copies
+        """
+        return list(self._bone_animations)
+
     def get_animated_bone_count(self) -> int:
         """
         Compute and return the number of animated bones
@@ -243,97 +752,752 @@ class Animation:
                 ret += 1
         return ret
 
+    def get_keyframe_count(self) -> int:
+        """
+        :return: the total number of keyframes (all bone animations)
+        """
+        return sum(bone_animation.get_keyframe_count() for bone_animation in self._bone_animations
+                   if bone_animation is not None)
+
+    def get_bone_keyframe_counts(self) -> list:
+        """
+        :return: the number of keyframes of each bone animation (None for bones that are not animated)
+        """
+        return [None if bone_animation is None else bone_animation.get_keyframe_count()
+                for bone_animation in self._bone_animations]
+
+    def get_bone_spans(self) -> list:
+        """
+        :return: where each bone animation would be in dump(), as a (offset, size) tuple (None for bones that are not
+                 animated)
+        """
+        division_offsets, _ = self._compute_layout()
+        return [None if bone_animation is None else (division_offset * 4, bone_animation.get_dump_size())
+                for division_offset, bone_animation in zip(division_offsets, self._bone_animations)]
+
+    def sample_pose(self, frame) -> list:
+        """
+        :param frame: Frame (it doesn't need to be an integer)
+        :return: the pose of the whole skeleton at frame: for each bone, its state (see BoneAnimation.sample(...)), or
+                 None if the bone is not animated
+        """
+        return self.sample_poses([frame])[0]
+
+    @instrumentation.timed("sample")
+    def sample_poses(self, frames) -> list:
+        """
+        Like sample_pose(...), but for many frames at once (each bone animation is sampled once for all the frames)
+        :param frames: List of frames
+        :return: the list of the poses
+        """
+        frames = list(frames)
+        bone_samples = [
+            [None] * len(frames) if bone_animation is None else instrumentation.run_on_bone(
+                "sample", bone_id, bone_animation.get_keyframe_count(), bone_animation.sample, frames
+            )
+            for bone_id, bone_animation in enumerate(self._bone_animations)
+        ]
+        return [list(pose) for pose in zip(*bone_samples)]
+
+    def get_dump_size(self) -> int:
+        """
+        :return: the size of the BT3's binary form of this Animation (the length of dump()). Bone animation sizes
+                 depend only on their type and keyframe count, so nothing is dumped
+        """
+        _, size = self._compute_layout()
+        return size
+
+    def _check_frame_count(self, method_name: str, new_frame_count: int):
+        if type(new_frame_count) != int or new_frame_count < 1:
+            raise InvalidFrameCountError(
+                f"Animation -> {method_name}(...) -> Error: invalid frame count ({new_frame_count})"
+            )
+
+    @instrumentation.timed("scale")
     def scale_frame_count(self, new_frame_count):
         """
         Change the frame count to new_frame_count. The animation is speed-uped or slow-downed.
         :param new_frame_count: New frame count
+        :raise InvalidFrameCountError: if new_frame_count is less than 1
         """
+        self._check_frame_count("scale_frame_count", new_frame_count)
         if self._frame_count == new_frame_count:
             return
 
-        for bone_animation in self._bone_animations:
-            if bone_animation is None:
-                continue
-            bone_animation.scale_timestamps_according_to_frame_count(self._frame_count, new_frame_count)
+        # The timestamps of all the bone animations are scaled together
+        _scale_bone_animations(self._bone_animations, self._frame_count, new_frame_count)
+
+        self._frame_count = new_frame_count
+
+    @instrumentation.timed("resample")
+    def resample_frame_count(self, new_frame_count):
+        """
+        Like scale_frame_count(...), but the keyframes are interpolated instead of just moved (see
+        BoneAnimation.resample_timestamps_according_to_frame_count(...)), so no keyframe is duplicated
+        :param new_frame_count: New frame count
+        :raise InvalidFrameCountError: if new_frame_count is less than 1
+        """
+        self._check_frame_count("resample_frame_count", new_frame_count)
+        if self._frame_count == new_frame_count:
+            return
+
+        for bone_id, bone_animation in enumerate(self._bone_animations):
+            if bone_animation is not None:
+                instrumentation.run_on_bone(
+                    "resample", bone_id, bone_animation.get_keyframe_count(),
+                    bone_animation.resample_timestamps_according_to_frame_count, self._frame_count, new_frame_count
+                )
 
         self._frame_count = new_frame_count
 
+    @instrumentation.timed("reduce")
+    def reduce_keyframes(self, angular_tolerance: float = 0.0, positional_tolerance: float = 0.0) -> int:
+        """
+        Drop the keyframes that can be interpolated from their neighbours, in all the bone animations (see
+        BoneAnimation.reduce_keyframes(...))
+        :param angular_tolerance: Maximum rotation error (radians)
+        :param positional_tolerance: Maximum translation error (distance)
+        :return: the number of bytes saved
+        """
+        old_dump_size = self.get_dump_size()
+        for bone_id, bone_animation in enumerate(self._bone_animations):
+            if bone_animation is not None:
+                instrumentation.run_on_bone(
+                    "reduce", bone_id, bone_animation.get_keyframe_count(),
+                    bone_animation.reduce_keyframes, angular_tolerance, positional_tolerance
+                )
+        return old_dump_size - self.get_dump_size()
+
+    def get_animated_bone_mask(self) -> int:
+        """
+        :return: the bone mask (see make_bone_mask(...)) of the animated bones
+        """
+        return sum(1 << bone_id for bone_id, bone_animation in enumerate(self._bone_animations)
+                   if bone_animation is not None)
+
     def import_bone_animations(self, source_animation: "Animation", bone_list):
         """
-        Import some bone animations from source_animation. source_animation has to have the same frame count of self.
+        Import some bone animations from source_animation (see import_bone_animations_many(...))
         :param source_animation: The source Animation
-        :param bone_list: List of bones (IDs) to import
+        :param bone_list: List of bones (IDs) to import, or their bone mask (see make_bone_mask(...))
+        :raise InvalidBoneIdError: if bone_list contains an invalid bone ID
         """
-        if self._frame_count != source_animation._frame_count:
-            print("Animation -> import_bone_animations(...) -> Error: source_animation has wrong number of frames")
-            return
+        self.import_bone_animations_many([(source_animation, bone_list)])
 
-        for bone_id in bone_list:
-            if type(bone_id) != int or bone_id < 0 or bone_id >= Animation.BONE_COUNT:
-                print(f"Animation -> import_bone_animations(...) -> Error: invalid bone_id ({bone_id}). Skipping.")
-                continue
-            self._bone_animations[bone_id] = source_animation._bone_animations[bone_id]
+    @instrumentation.timed("mix")
+    def import_bone_animations_many(self, sources: list):
+        """
+        Import bone animations from many source animations at once. The imported bone animations are copies: later
+        changes to the source animations don't affect self.
+        If a source animation has a different frame count, only its imported bone animations are scaled (see
+        BoneAnimation.scale_timestamps_according_to_frame_count(...)), not the whole source animation.
+        If a bone is imported from more sources, the last one wins. A bone not animated in its source animation becomes
+        not animated in self too.
+        Nothing is imported if an error is raised.
+        :param sources: List of (source Animation, bone list or bone mask) tuples
+        :raise InvalidBoneIdError: if a bone list contains an invalid bone ID
+        """
+        bone_masks = [bone_list if type(bone_list) == int else make_bone_mask(bone_list) for _, bone_list in sources]
+        for bone_mask in bone_masks:
+            if bone_mask < 0 or bone_mask >> Animation.BONE_COUNT:
+                raise InvalidBoneIdError(
+                    f"Animation -> import_bone_animations_many(...) -> Error: invalid bone mask ({bone_mask:#x})"
+                )
+
+        # Only the bone animations that are actually imported (the last source of each bone) are copied and scaled
+        imported_bone_animations = [None] * Animation.BONE_COUNT
+        remaining_bone_mask = (1 << Animation.BONE_COUNT) - 1
+        for (source_animation, _), bone_mask in reversed(list(zip(sources, bone_masks))):
+            bone_mask &= remaining_bone_mask
+            remaining_bone_mask &= ~bone_mask
+            bone_ids = get_bone_mask_bones(bone_mask)
+            bone_animations = [source_animation._bone_animations[bone_id] for bone_id in bone_ids]
+            bone_animations = [None if bone_animation is None else bone_animation.copy()
+                               for bone_animation in bone_animations]
+
+            # The timestamps of the imported bone animations of a source are scaled together
+            if source_animation._frame_count != self._frame_count:
+                _scale_bone_animations(bone_animations, source_animation._frame_count, self._frame_count)
+
+            for bone_id, bone_animation in zip(bone_ids, bone_animations):
+                imported_bone_animations[bone_id] = bone_animation
+
+        for bone_id in get_bone_mask_bones(~remaining_bone_mask & ((1 << Animation.BONE_COUNT) - 1)):
+            self._bone_animations[bone_id] = imported_bone_animations[bone_id]
 
-    def concat(self, source_animation: "Animation") -> list:
+    def concat(self, source_animation: "Animation", blend_frames: int = 0) -> list:
         """
         Concat self with source_animation.
         The final frame count is the sum of the 2 frame counts plus 1 (a frame is used to implement the animation from
         the last keyframe of self to the first of source_animation.
+        With blend_frames, the two animations overlap for blend_frames frames instead, and there the bones crossfade
+        from self to source_animation (see concat_many(...)). The final frame count is reduced accordingly.
         :param source_animation: The animation to append at the "end" of self
+        :param blend_frames: Length of the crossfade (frames)
         :return: Dropped bone animations (list of bone IDs)
         """
-        for bone_id in range(self.BONE_COUNT):
-            if self._bone_animations[bone_id] is not None and \
-               source_animation._bone_animations[bone_id] is not None and \
-               (self._bone_animations[bone_id].get_type() != source_animation._bone_animations[bone_id].get_type()):
+        return self.concat_many([source_animation], blend_frames)
+
+    @instrumentation.timed("concat")
+    def concat_many(self, source_animations: list, blend_frames: int = 0) -> list:
+        """
+        Concat self with many animations, one after the other. The result is the same of calling concat(...) for each
+        of them, but the keyframe arrays of each bone animation are built just once, with the timestamp offsets of all
+        the sources computed in advance.
+        Each join adds a frame (see concat(...)). A bone animation is dropped if it's missing in any of the animations.
+        With blend_frames, each animation starts blend_frames - 1 frames before the end of the previous one (so each
+        join removes blend_frames - 1 frames). In the blend_frames frames where two animations overlap, their keyframes
+        are replaced by a keyframe for each frame, interpolating (slerp for rotations, lerp for translations) the two
+        animations with a weight going from the previous one to the next one. The transition keyframes of all the bones
+        and joins are computed together. The crossfades always interpolate the original keyframes of the animations, so
+        the result can differ slightly from calling concat(...) for each of them.
+        Nothing is changed if an error is raised.
+        :param source_animations: The animations to append at the "end" of self (in order)
+        :param blend_frames: Length of each crossfade (frames)
+        :return: Dropped bone animations (list of bone IDs)
+        :raise UnconcatenableAnimationsError: if a bone animation has a different type in one of the animations, or if
+                                              an animation is too short for its crossfades
+        """
+        # The crossfades with the previous and the next animation can't overlap
+        frame_counts = [self._frame_count] + [source_animation._frame_count for source_animation in source_animations]
+        for i, frame_count in enumerate(frame_counts):
+            joins = (i > 0) + (i < len(source_animations))
+            if blend_frames < 0 or frame_count + 1 < blend_frames * joins:
                 raise UnconcatenableAnimationsError(
-                    f"Animation -> concat(...) -> Error: bone animation {bone_id} has wrong type"
+                    f"Animation -> concat(...) -> Error: invalid blend_frames ({blend_frames}) for an animation of "
+                    f"{frame_count} frames"
                 )
 
         dropped = []
+        concatenated = []
 
         for bone_id in range(self.BONE_COUNT):
-            if self._bone_animations[bone_id] is None and source_animation._bone_animations[bone_id] is not None or \
-               self._bone_animations[bone_id] is not None and source_animation._bone_animations[bone_id] is None:
-                self._bone_animations[bone_id] = None
-                dropped.append(bone_id)
+            bone_animation = self._bone_animations[bone_id]
+            source_bone_animations = [source_animation._bone_animations[bone_id]
+                                      for source_animation in source_animations]
+
+            # Like joining the animations one at a time: the type matters until the bone animation is dropped
+            for source_bone_animation in source_bone_animations:
+                if bone_animation is None or source_bone_animation is None:
+                    break
+                if bone_animation.get_type() != source_bone_animation.get_type():
+                    raise UnconcatenableAnimationsError(
+                        f"Animation -> concat(...) -> Error: bone animation {bone_id} has wrong type"
+                    )
+
+            if bone_animation is None and all(source_bone_animation is None
+                                              for source_bone_animation in source_bone_animations):
                 continue
-            if self._bone_animations[bone_id] is None and source_animation._bone_animations[bone_id] is None:
-                self._bone_animations[bone_id] = None
+            if bone_animation is None or any(source_bone_animation is None
+                                             for source_bone_animation in source_bone_animations):
+                dropped.append(bone_id)
                 continue
-            self._bone_animations[bone_id].concat(
-                old_frame_count=self._frame_count, source_bone_animation=source_animation._bone_animations[bone_id]
+            concatenated.append((bone_animation, source_bone_animations))
+
+        for bone_id in dropped:
+            self._bone_animations[bone_id] = None
+
+        # Timestamp offset of each source animation
+        offsets = []
+        frame_count = self._frame_count
+        for source_animation in source_animations:
+            offsets.append(frame_count + 1 - blend_frames)
+            frame_count = offsets[-1] + source_animation._frame_count
+
+        if blend_frames > 0:
+            self._concat_blended(concatenated, offsets, blend_frames)
+            self._frame_count = frame_count
+            return dropped
+
+        # The timestamps of all the source bone animations are shifted together
+        source_timestamp_arrays = []
+        timestamp_offsets = []
+        for _, source_bone_animations in concatenated:
+            for source_bone_animation, offset in zip(source_bone_animations, offsets):
+                source_bone_animation._decode()
+                source_timestamp_arrays.append(source_bone_animation._timestamps)
+                timestamp_offsets.append(offset)
+        source_timestamp_arrays = offset_timestamps(source_timestamp_arrays, timestamp_offsets)
+
+        for i, (bone_animation, source_bone_animations) in enumerate(concatenated):
+            first = i * len(source_animations)
+            bone_animation._append(
+                source_bone_animations, source_timestamp_arrays[first:first + len(source_animations)]
             )
 
-        self._frame_count += 1 + source_animation._frame_count
+        self._frame_count = frame_count
 
         return dropped
 
-    def dump(self) -> bytes:
+    def _concat_blended(self, concatenated: list, offsets: list, blend_frames: int):
+        """
+        Implementation of concat_many(...) with crossfades
+        :param concatenated: List of (bone animation of self, bone animations of the source animations) tuples
+        :param offsets: Timestamp offset of each source animation
+        :param blend_frames: Length of each crossfade (frames)
+        """
+        offsets = [0] + offsets
+        window = range(blend_frames)
+        window_weights = [(k + 1) / (blend_frames + 1) for k in window]
+
+        # Sample both sides of every crossfade, as (from, to) pairs of states for interpolate_*(...)
+        rotations = []
+        translations = array("f")
+        rotation_weights = []
+        translation_weights = []
+        transitions = []  # For each bone animation and join, the transition keyframes (None if there are no keyframes)
+        for bone_animation, source_bone_animations in concatenated:
+            clips = [bone_animation] + source_bone_animations
+            for j in range(1, len(clips)):
+                states_from = clips[j - 1].sample([offsets[j] - offsets[j - 1] + k for k in window])
+                states_to = clips[j].sample(list(window))
+                if states_from[0] is None and states_to[0] is None:
+                    transitions.append(None)
+                    continue
+                states_from = states_from if states_from[0] is not None else states_to
+                states_to = states_to if states_to[0] is not None else states_from
+                transitions.append(len(rotation_weights))
+                for state_from, state_to in zip(states_from, states_to):
+                    rotations += [state_from[0], state_to[0]]
+                    if bone_animation.get_type() == 0:
+                        translations.extend(state_from[1] + state_to[1])
+                rotation_weights += window_weights
+                if bone_animation.get_type() == 0:
+                    translation_weights += window_weights
+
+        # All the transition keyframes are interpolated together
+        rot_structs = encode_rotations(
+            interpolate_rotations(rotations, range(0, len(rotations), 2), rotation_weights)
+        )
+        translations = interpolate_translations(translations, range(0, len(translations) // 3, 2), translation_weights)
+        window_timestamps = [array("I", [offset + k for k in window]) for offset in offsets]
+
+        # The keyframes of each animation that are not in a crossfade are kept, between the transition keyframes
+        keyframe_ranges = []
+        kept_keyframe_ranges = []
+        kept_offsets = []
+        transitions = iter(transitions)
+        translation_cursor = 0
+        for bone_animation, source_bone_animations in concatenated:
+            clips = [bone_animation] + source_bone_animations
+            bone_keyframe_ranges = []
+            for i, clip in enumerate(clips):
+                clip._decode()
+                first = 0 if i == 0 else bisect_left(clip._timestamps, blend_frames)
+                last = len(clip._timestamps) if i == len(clips) - 1 else \
+                    bisect_left(clip._timestamps, offsets[i + 1] - offsets[i])
+                bone_keyframe_ranges.append(list(clip._get_keyframe_range(first, last)))
+                kept_keyframe_ranges.append(bone_keyframe_ranges[-1])
+                kept_offsets.append(offsets[i])
+
+                cursor = next(transitions) if i < len(clips) - 1 else None
+                if cursor is None:
+                    continue
+                transition_translations = array("f")
+                if bone_animation.get_type() == 0:
+                    transition_translations = translations[translation_cursor:translation_cursor + blend_frames * 3]
+                    translation_cursor += blend_frames * 3
+                bone_keyframe_ranges.append((
+                    window_timestamps[i + 1], transition_translations,
+                    rot_structs[cursor * _ROT_STRUCT_SIZE:(cursor + blend_frames) * _ROT_STRUCT_SIZE]
+                ))
+            keyframe_ranges.append(bone_keyframe_ranges)
+
+        # The timestamps of all the kept keyframes are shifted together
+        shifted_timestamps = offset_timestamps(
+            [keyframe_range[0] for keyframe_range in kept_keyframe_ranges], kept_offsets
+        )
+        for keyframe_range, timestamps in zip(kept_keyframe_ranges, shifted_timestamps):
+            keyframe_range[0] = timestamps
+
+        for (bone_animation, _), bone_keyframe_ranges in zip(concatenated, keyframe_ranges):
+            bone_animation._set_keyframes(bone_keyframe_ranges)
+
+    def _check_frame_range(self, method_name: str, start_frame: int, end_frame: int):
+        if type(start_frame) != int or type(end_frame) != int or not 0 <= start_frame <= end_frame <= self._frame_count:
+            raise InvalidFrameRangeError(
+                f"Animation -> {method_name}(...) -> Error: invalid frame range ({start_frame}, {end_frame}) for an "
+                f"animation of {self._frame_count} frames"
+            )
+
+    @instrumentation.timed("slice")
+    def slice(self, start_frame: int, end_frame: int) -> "Animation":
         """
-        Compute and return the BT3's binary form of this Animation as bytes
+        Extract a part of the animation. The keyframes are found by binary search on the timestamps, and only the ones
+        in the part are decoded. If a bone animation has no keyframe exactly at start_frame or at end_frame, one is
+        interpolated from the keyframes around it (slerp for rotations, lerp for translations).
+        :param start_frame: First frame
+        :param end_frame: Last frame (included)
+        :return: a new Animation of end_frame - start_frame frames (self is not changed)
+        :raise InvalidFrameRangeError: if the frames are not 0 <= start_frame <= end_frame <= frame count
         """
-        # Header dump
-        header_dump = p16(self._magic) + p16(self._frame_count)
-        header_size = 4 + Animation.BONE_COUNT * 2 + len(self._header_rem)
+        self._check_frame_range("slice", start_frame, end_frame)
 
-        # Body dump
-        body_dump = b""
-        for i in range(Animation.BONE_COUNT):
-            if self._bone_animations[i] is None:
-                header_dump += p16(0)
+        animation = copy.copy(self)
+        animation._bone_animations = [None if bone_animation is None else bone_animation.slice(start_frame, end_frame)
+                                      for bone_animation in self._bone_animations]
+        animation._frame_count = end_frame - start_frame
+        return animation
+
+    @instrumentation.timed("splice")
+    def splice(self, start_frame: int, end_frame: int, source_animation: "Animation" = None) -> list:
+        """
+        Replace a part of the animation with source_animation, or just remove it.
+        The keyframes before start_frame are kept as they are, source_animation starts from start_frame and the part
+        from end_frame on is moved to start one frame after the end of source_animation (like concat(...)). Without
+        source_animation, the part from end_frame on is moved to start_frame. If a bone animation has no keyframe
+        exactly at end_frame, one is interpolated from the keyframes around it (see slice(...)).
+        A bone animation is dropped if it's missing in source_animation (or vice versa).
+        Nothing is changed if an error is raised.
+        :param start_frame: First frame of the part to replace
+        :param end_frame: First frame after the part to replace
+        :param source_animation: The animation to insert (None to just remove the part)
+        :return: Dropped bone animations (list of bone IDs)
+        :raise InvalidFrameRangeError: if the frames are not 0 <= start_frame <= end_frame <= frame count
+        :raise UnconcatenableAnimationsError: if a bone animation has a different type in source_animation
+        """
+        self._check_frame_range("splice", start_frame, end_frame)
+
+        dropped = []
+        if source_animation is not None:
+            for bone_id, (bone_animation, source_bone_animation) in enumerate(
+                    zip(self._bone_animations, source_animation._bone_animations)):
+                if bone_animation is None and source_bone_animation is None:
+                    continue
+                if bone_animation is None or source_bone_animation is None:
+                    dropped.append(bone_id)
+                    continue
+                if bone_animation.get_type() != source_bone_animation.get_type():
+                    raise UnconcatenableAnimationsError(
+                        f"Animation -> splice(...) -> Error: bone animation {bone_id} has wrong type"
+                    )
+
+        for bone_id in dropped:
+            self._bone_animations[bone_id] = None
+
+        # Where the part from end_frame on is moved
+        moved_start_frame = start_frame
+        if source_animation is not None:
+            moved_start_frame += source_animation._frame_count + 1
+
+        # Keyframe ranges of all the bone animations, whose timestamps are shifted together
+        spliced = []
+        keyframe_ranges = []
+        offsets = []
+        for bone_id, bone_animation in enumerate(self._bone_animations):
+            if bone_animation is None:
                 continue
-            header_dump += p16((header_size + len(body_dump)) // 4)
-            body_dump += self._bone_animations[i].dump()
+            bone_keyframe_ranges = [
+                bone_animation._get_keyframe_range(0, bisect_left(bone_animation._get_timestamp_view(), start_frame))
+            ]
+            bone_offsets = [0]
+            if source_animation is not None:
+                source_bone_animation = source_animation._bone_animations[bone_id]
+                bone_keyframe_ranges.append(
+                    source_bone_animation._get_keyframe_range(0, source_bone_animation.get_keyframe_count())
+                )
+                bone_offsets.append(start_frame)
+            bone_keyframe_ranges += bone_animation._get_time_range(end_frame)
+            bone_offsets += [moved_start_frame - end_frame] * (len(bone_keyframe_ranges) - len(bone_offsets))
+            spliced.append((bone_animation, len(bone_keyframe_ranges)))
+            keyframe_ranges += bone_keyframe_ranges
+            offsets += bone_offsets
+
+        keyframe_ranges = _offset_keyframe_ranges(keyframe_ranges, offsets)
+        cursor = 0
+        for bone_animation, count in spliced:
+            bone_animation._set_keyframes(keyframe_ranges[cursor:cursor + count])
+            cursor += count
 
-        # Complete header dump
-        header_dump += self._header_rem
+        self._frame_count = moved_start_frame + self._frame_count - end_frame
 
-        # Check len(header_dump)
-        assert len(header_dump) == header_size
+        return dropped
 
-        # Padding and returning header_dump and body_dump as a single bytes
-        dump = header_dump + body_dump
-        while len(dump) % 16 != 0:
-            dump += b"\x00"
-        return dump
+    def _compute_layout(self) -> tuple:
+        """
+        Compute the layout of the BT3's binary form of this Animation
+        :return: the division offsets (bone animation offsets / 4, 0 for bones that are not animated) and the total size
+                 (padding included)
+        """
+        division_offsets = []
+        size = _OFFSET_TABLE_STRUCT.size + len(self._header_rem)
+        for bone_animation in self._bone_animations:
+            if bone_animation is None:
+                division_offsets.append(0)
+                continue
+            division_offsets.append(size // 4)
+            size += bone_animation.get_dump_size()
+        size += -size % 16
+        return division_offsets, size
+
+    def _iter_segments(self, cache: bool = True):
+        """
+        Generate the BT3's binary form of this Animation segment by segment (header, one for each animated bone,
+        padding). The segments of the bone animations are their cached binary forms (no copies).
+        :param cache: If False, the binary forms of the changed bone animations are not cached (see
+                      BoneAnimation._get_encoded(...)), so only one of them at a time is kept in memory
+        """
+        division_offsets, size = self._compute_layout()
+        yield _OFFSET_TABLE_STRUCT.pack(self._magic, self._frame_count, *division_offsets)
+        yield self._header_rem
+        segments_size = _OFFSET_TABLE_STRUCT.size + len(self._header_rem)
+        for bone_id, bone_animation in enumerate(self._bone_animations):
+            if bone_animation is not None:
+                segment = instrumentation.run_on_bone(
+                    "encode", bone_id, bone_animation.get_keyframe_count(), bone_animation._get_encoded, cache
+                )
+                segments_size += len(segment)
+                yield segment
+        yield bytes(size - segments_size)
+
+    def _get_segments(self) -> list:
+        """
+        :return: the BT3's binary form of this Animation as a list of segments (see _iter_segments(...))
+        """
+        return list(self._iter_segments())
+
+    @instrumentation.timed("write")
+    def write_to(self, file) -> int:
+        """
+        Write the BT3's binary form of this Animation to a file, segment by segment: the whole dump is never built.
+        The binary forms of the changed bone animations are not cached, so the memory used stays around the size of
+        a single bone animation.
+        :param file: Binary file object (opened for writing)
+        :return: the number of bytes written
+        """
+        file.writelines(self._iter_segments(cache=False))
+        return self.get_dump_size()
+
+    @instrumentation.timed("dump")
+    def dump(self) -> bytes:
+        """
+        Compute and return the BT3's binary form of this Animation as bytes.
+        Only the bone animations changed since the last dump() are encoded again, the others are just copied.
+        """
+        return b"".join(self._get_segments())
+
+    def digest(self) -> str:
+        """
+        :return: the content hash (SHA-256, hexadecimal) of dump(), computed segment by segment (the whole dump is never
+                 built). For an unchanged animation whose file has the standard layout, it's the hash of the file
+        """
+        content_hash = hashlib.sha256()
+        for segment in self._iter_segments():
+            content_hash.update(segment)
+        return content_hash.hexdigest()
+
+
+def validate_animation_dump(dump: bytes):
+    """
+    Check the structure of an animation file dump (offset table, bone animation types and keyframe blocks bounds)
+    without decoding any keyframe. An Animation can be built from every dump that passes this check.
+    :param dump: Animation file dump
+    :raise InvalidAnimationError: if the dump is not valid
+    """
+    if len(dump) < _OFFSET_TABLE_STRUCT.size:
+        raise InvalidAnimationError(f"validate_animation_dump(...) -> Error: dump too short ({len(dump)} bytes)")
+
+    _, _, *division_offsets = _OFFSET_TABLE_STRUCT.unpack_from(dump)
+    if not any(division_offsets):
+        raise InvalidAnimationError("validate_animation_dump(...) -> Error: no animated bones")
+
+    for bone_id, division_offset in enumerate(division_offsets):
+        if division_offset == 0:
+            continue
+        offset = division_offset * 4
+        if offset < _OFFSET_TABLE_STRUCT.size:
+            raise InvalidAnimationError(
+                f"validate_animation_dump(...) -> Error: bone animation {bone_id} overlaps the header"
+            )
+        if offset + _BONE_HEADER_STRUCT.size > len(dump):
+            raise InvalidAnimationError(
+                f"validate_animation_dump(...) -> Error: bone animation {bone_id} starts out of the dump"
+            )
+        bone_type, keyframe_count = _BONE_HEADER_STRUCT.unpack_from(dump, offset)
+        if bone_type != 0 and bone_type != 1:
+            raise InvalidAnimationError(
+                f"validate_animation_dump(...) -> Error: bone animation {bone_id} has invalid type ({bone_type})"
+            )
+        if offset + _get_bone_dump_size(bone_type, keyframe_count) > len(dump):
+            raise InvalidAnimationError(
+                f"validate_animation_dump(...) -> Error: bone animation {bone_id} keyframes don't fit in the dump"
+            )
+
+
+class AnimationInfo:
+    """
+    Header information of an animation (magic, frame count, bone animation offsets and, optionally, bone animation
+    types and keyframe counts), read without decoding any keyframe
+    """
+
+    HEADER_SIZE = _OFFSET_TABLE_STRUCT.size
+    BONE_HEADER_SIZE = _BONE_HEADER_STRUCT.size
+
+    def __init__(self, header: bytes, size: int = None, bone_headers: list = None):
+        """
+        Constructor
+        :param header: At least the first AnimationInfo.HEADER_SIZE bytes of an animation file
+        :param size: Animation file size (if known)
+        :param bone_headers: The first AnimationInfo.BONE_HEADER_SIZE bytes of each bone animation (None for bones that
+                             are not animated), if known
+        :raise InvalidAnimationError: if a bone animation has an invalid type
+        """
+        self._magic, self._frame_count, *division_offsets = _OFFSET_TABLE_STRUCT.unpack_from(header)
+        self._bone_offsets = [division_offset * 4 if division_offset != 0 else None
+                              for division_offset in division_offsets]
+        self._size = size
+
+        # Bone ID -> (type, keyframe count)
+        self._bone_headers = None
+        if bone_headers is not None:
+            self._bone_headers = [_BONE_HEADER_STRUCT.unpack(bone_header) if bone_header is not None else None
+                                  for bone_header in bone_headers]
+            for bone_id, bone_header in enumerate(self._bone_headers):
+                if bone_header is not None and bone_header[0] != 0 and bone_header[0] != 1:
+                    raise InvalidAnimationError(
+                        f"AnimationInfo -> __init__(...) -> Error: bone animation {bone_id} has invalid type "
+                        f"({bone_header[0]})"
+                    )
+
+    def get_magic(self) -> int:
+        return self._magic
+
+    def get_frame_count(self) -> int:
+        return self._frame_count
+
+    def get_animated_bones(self) -> list:
+        """
+        :return: the IDs of the animated bones
+        """
+        return [bone_id for bone_id, bone_offset in enumerate(self._bone_offsets) if bone_offset is not None]
+
+    def get_animated_bone_count(self) -> int:
+        return len(self.get_animated_bones())
+
+    def get_bone_offsets(self) -> list:
+        """
+        :return: the offset of each bone animation inside the file (None for bones that are not animated)
+        """
+        return list(self._bone_offsets)
+
+    def get_size(self) -> int:
+        """
+        :return: the file size (None if unknown)
+        """
+        return self._size
+
+    def has_bone_headers(self) -> bool:
+        """
+        :return: True if the types and keyframe counts of the bone animations are known
+        """
+        return self._bone_headers is not None
+
+    def get_bone_type(self, bone_id: int):
+        """
+        :param bone_id: Bone ID
+        :return: the type of the bone animation (None if the bone is not animated or bone headers are unknown)
+        """
+        if self._bone_headers is None or self._bone_headers[bone_id] is None:
+            return None
+        return self._bone_headers[bone_id][0]
+
+    def get_bone_keyframe_count(self, bone_id: int):
+        """
+        :param bone_id: Bone ID
+        :return: the keyframe count of the bone animation (None if the bone is not animated or bone headers are
+                 unknown)
+        """
+        if self._bone_headers is None or self._bone_headers[bone_id] is None:
+            return None
+        return self._bone_headers[bone_id][1]
+
+
+def read_animation_info(file_path: str, bone_headers: bool = False) -> AnimationInfo:
+    """
+    Read the header of an animation file. Only the first AnimationInfo.HEADER_SIZE bytes are read, plus the first
+    AnimationInfo.BONE_HEADER_SIZE bytes of each bone animation if bone_headers is True.
+    :param file_path: Animation file path
+    :param bone_headers: If True, the types and keyframe counts of the bone animations are read too
+    :return: the AnimationInfo of the file
+    :raise InvalidAnimationError: if the file is too short, or (with bone_headers) has invalid bone animations
+    """
+    with open(file_path, "rb") as file:
+        header = file.read(AnimationInfo.HEADER_SIZE)
+        size = os.fstat(file.fileno()).st_size
+        if len(header) < AnimationInfo.HEADER_SIZE:
+            raise InvalidAnimationError(f"read_animation_info(...) -> Error: file too short ({size} bytes)")
+        if not bone_headers:
+            return AnimationInfo(header, size)
+
+        headers = []
+        for bone_id, division_offset in enumerate(_OFFSET_TABLE_STRUCT.unpack_from(header)[2:]):
+            if division_offset == 0:
+                headers.append(None)
+                continue
+            if division_offset * 4 < AnimationInfo.HEADER_SIZE or division_offset * 4 + _BONE_HEADER_STRUCT.size > size:
+                raise InvalidAnimationError(
+                    f"read_animation_info(...) -> Error: bone animation {bone_id} starts out of the file"
+                )
+            file.seek(division_offset * 4)
+            headers.append(file.read(_BONE_HEADER_STRUCT.size))
+    return AnimationInfo(header, size, headers)
+
+
+def _create_temp_file(file_path: str) -> tuple:
+    """
+    Create a new temporary file next to file_path. Like open(...), it's created with the permissions allowed by the
+    umask (unlike tempfile.mkstemp(...), that makes it readable only by its owner)
+    :return: the file descriptor (opened for writing) and the path of the temporary file
+    """
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, "O_BINARY", 0)
+    while True:
+        temp_file_path = os.path.join(
+            os.path.dirname(file_path), f".{os.path.basename(file_path)}.{os.urandom(4).hex()}.tmp"
+        )
+        try:
+            return os.open(temp_file_path, flags, 0o666), temp_file_path
+        except FileExistsError:
+            continue
+
+
+@instrumentation.timed("save")
+def save_animation(animation: Animation, file_path: str) -> int:
+    """
+    Save an animation on disk, atomically: it's streamed to a temporary file in the same directory (see
+    Animation.write_to(...)), which then replaces file_path. If an error occurs, file_path is left untouched.
+    :param animation: The animation to save
+    :param file_path: Destination file path
+    :return: the number of bytes written
+    """
+    file_path = os.path.abspath(file_path)
+    descriptor, temp_file_path = _create_temp_file(file_path)
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            size = animation.write_to(file)
+        # A replaced file keeps its permissions
+        if os.path.exists(file_path):
+            os.chmod(temp_file_path, os.stat(file_path).st_mode & 0o7777)
+        os.replace(temp_file_path, file_path)
+    except BaseException:
+        os.remove(temp_file_path)
+        raise
+
+    if instrumentation.ENABLED:
+        instrumentation.count("bytes_written", size)
+    return size
+
+
+def load_animation(file_path: str) -> Animation:
+    """
+    Load an animation from disk
+    :param file_path: Animation file path
+    :raise InvalidAnimationError: if the file is not a valid animation
+    """
+    with instrumentation.stage("read"):
+        with open(file_path, "rb") as file:
+            dump = file.read()
+    if instrumentation.ENABLED:
+        instrumentation.count("bytes_read", len(dump))
+    if len(dump) <= 0:
+        raise InvalidAnimationError(f"load_animation(...) -> Error: {file_path} is empty")
+    return Animation(dump)
@@ -0,0 +1,108 @@
+"""
+This module provides a cache of parsed animations, useful when the same "donor" animations (eg. a common tail bone
+animation) are mixed into or joined with many others
+"""
+
+
+import os
+from collections import OrderedDict
+from anim.bt3animation import Animation, load_animation
+from anim import instrumentation
+
+
+class AnimationCache:
+    """
+    LRU cache of the animations loaded from disk.
+    Entries are keyed by file path, modification time and size, so a changed file is loaded again. The total size of
+    the cached animations is kept under a memory budget: the least recently used ones are evicted first.
+    Animations are never returned directly, but as independent copies (cheap, since untouched bone animations share
+    the original binary form).
+    """
+
+    def __init__(self, memory_budget: int = 64 * 1024 * 1024):
+        """
+        Constructor
+        :param memory_budget: Maximum total size (in bytes) of the cached animations
+        """
+        self._memory_budget = memory_budget
+        self._entries = OrderedDict()  # File key -> (Animation, size)
+        self._memory_usage = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _get_file_key(file_path: str) -> tuple:
+        stat = os.stat(file_path)
+        return os.path.realpath(file_path), stat.st_mtime_ns, stat.st_size
+
+    def _lookup(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _store(self, key: tuple, animation: Animation):
+        # Older versions of the same file are not useful anymore
+        for old_key in [old_key for old_key in self._entries if old_key[0] == key[0] and old_key != key]:
+            self._evict(old_key)
+
+        size = animation.get_dump_size()
+        if size > self._memory_budget:
+            return
+        self._entries[key] = (animation, size)
+        self._memory_usage += size
+        while self._memory_usage > self._memory_budget:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: tuple):
+        _, size = self._entries.pop(key)
+        self._memory_usage -= size
+        self._evictions += 1
+        if instrumentation.ENABLED:
+            instrumentation.count("cache_evictions")
+
+    def get(self, file_path: str) -> Animation:
+        """
+        Load an animation, from the cache if possible. Hits and misses are also counted by the instrumentation
+        ("cache_hits" and "cache_misses", see anim.instrumentation)
+        :param file_path: Animation file path
+        :return: a copy of the cached animation (it can be freely changed)
+        :raise InvalidAnimationError: if the file is not a valid animation
+        """
+        file_key = self._get_file_key(file_path)
+
+        # A hit means that the file has not been read and parsed again
+        animation = self._lookup(file_key)
+        if animation is None:
+            self._misses += 1
+            if instrumentation.ENABLED:
+                instrumentation.count("cache_misses")
+            animation = load_animation(file_path)
+            self._store(file_key, animation)
+        else:
+            self._hits += 1
+            if instrumentation.ENABLED:
+                instrumentation.count("cache_hits")
+        return animation.copy()
+
+    def clear(self):
+        """
+        Remove all the cached animations (statistics are kept)
+        """
+        self._entries.clear()
+        self._memory_usage = 0
+
+    def get_stats(self) -> dict:
+        """
+        :return: cache statistics (hits, misses, evictions, number of entries and memory usage)
+        """
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "entries": len(self._entries),
+            "memory_usage": self._memory_usage,
+            "memory_budget": self._memory_budget,
+        }
@@ -0,0 +1,164 @@
+"""
+This module provides a non-destructive edit history of an animation, with undo and redo.
+Every version is kept, but versions share their unchanged bone animations (copy-on-write per bone): a bone animation is
+stored once, as its binary form, however many versions use it, so memory grows with what changed at each step, not
+with the whole animation. Going to another version (undo, redo, back to the original) reads and parses nothing.
+"""
+
+
+from anim.bt3animation import Animation, BoneAnimation
+
+
+class EditHistory:
+    """
+    Edit history of an animation. Versions are never changed: get_animation() gives a working copy of the current
+    version, which is changed and then recorded as a new version by commit(...) (or use apply(...), that does both).
+    Stored bone animations are never decoded, so working copies are cheap: they share the stored binary forms until a
+    bone animation is changed (see BoneAnimation.copy()).
+    """
+
+    def __init__(self, animation: Animation, max_versions: int = None):
+        """
+        Constructor
+        :param animation: The original animation (version 0). It's not changed, and can be freely used afterwards
+        :param max_versions: Maximum number of versions after the original one (the oldest are forgotten first, the
+                             original is always kept). None for no limit
+        """
+        self._max_versions = max_versions
+        self._bone_animations = {}  # Digest -> stored BoneAnimation (shared by the versions)
+        self._original = self._freeze(animation)
+        self._versions = [("original", self._original)]  # (label, stored Animation)
+        self._position = 0
+
+    def _freeze_bone_animation(self, bone_animation: BoneAnimation) -> BoneAnimation:
+        """
+        :return: the stored version of a bone animation: an already stored one with the same binary form, or a new one
+                 built from its binary form (so it's never decoded, and not shared with working copies)
+        """
+        digest = bone_animation.digest()
+        stored_bone_animation = self._bone_animations.get(digest)
+        if stored_bone_animation is None:
+            stored_bone_animation = BoneAnimation(bone_animation.dump())
+            stored_bone_animation.digest()
+            self._bone_animations[digest] = stored_bone_animation
+        return stored_bone_animation
+
+    def _freeze(self, animation: Animation) -> Animation:
+        """
+        :return: the stored version of an animation (see _freeze_bone_animation(...))
+        """
+        return Animation.from_bone_animations(
+            animation.get_magic(), animation.get_frame_count(), animation.get_header_rem(),
+            [None if bone_animation is None else self._freeze_bone_animation(bone_animation)
+             for bone_animation in animation.get_bone_animations()]
+        )
+
+    def _forget_unused_bone_animations(self):
+        used_digests = {bone_animation.digest() for _, version in self._versions
+                        for bone_animation in version.get_bone_animations() if bone_animation is not None}
+        for digest in [digest for digest in self._bone_animations if digest not in used_digests]:
+            del self._bone_animations[digest]
+
+    def get_animation(self, position: int = None) -> Animation:
+        """
+        :param position: Index of the version (see get_labels()). None for the current version
+        :return: a working copy of the version (it can be freely changed, see EditHistory)
+        """
+        return self._versions[self._position if position is None else position][1].copy()
+
+    def get_original_animation(self) -> Animation:
+        """
+        :return: a working copy of the original animation
+        """
+        return self._original.copy()
+
+    def commit(self, animation: Animation, label: str):
+        """
+        Record an animation (usually a changed working copy, see get_animation()) as a new version after the current
+        one. The versions that could be redone are forgotten. The animation is not changed, and can be freely used
+        afterwards.
+        :param animation: The new version
+        :param label: Description of the change (eg. "scale to 40 frames")
+        """
+        del self._versions[self._position + 1:]
+        self._versions.append((label, self._freeze(animation)))
+        if self._max_versions is not None and len(self._versions) - 1 > self._max_versions:
+            del self._versions[1:len(self._versions) - 1 - self._max_versions]
+        self._position = len(self._versions) - 1
+        self._forget_unused_bone_animations()
+
+    def apply(self, label: str, operation, *args):
+        """
+        Change a working copy of the current version with operation(animation, *args) and record it as a new version
+        (see commit(...)). If operation raises an error, nothing is recorded.
+        :param label: Description of the change
+        :param operation: Function that changes the animation (eg. Animation.scale_frame_count)
+        :return: the result of operation
+        """
+        animation = self.get_animation()
+        result = operation(animation, *args)
+        self.commit(animation, label)
+        return result
+
+    def revert(self):
+        """
+        Go back to the original animation, recorded as a new version (so it can be undone)
+        """
+        self.commit(self._original, "back to the original")
+
+    def can_undo(self) -> bool:
+        return self._position > 0
+
+    def can_redo(self) -> bool:
+        return self._position < len(self._versions) - 1
+
+    def undo(self) -> str:
+        """
+        Go back to the previous version
+        :return: the label of the undone change (None if there is nothing to undo)
+        """
+        if not self.can_undo():
+            return None
+        self._position -= 1
+        return self._versions[self._position + 1][0]
+
+    def redo(self) -> str:
+        """
+        Go forward to the next version (undone by undo())
+        :return: the label of the redone change (None if there is nothing to redo)
+        """
+        if not self.can_redo():
+            return None
+        self._position += 1
+        return self._versions[self._position][0]
+
+    def get_labels(self) -> list:
+        """
+        :return: the labels of all the versions (the first one is the original animation)
+        """
+        return [label for label, _ in self._versions]
+
+    def get_position(self) -> int:
+        """
+        :return: the index of the current version (see get_labels())
+        """
+        return self._position
+
+    def get_last_label(self) -> str:
+        """
+        :return: the label of the change that gave the current version (None for the original animation)
+        """
+        return self._versions[self._position][0] if self._position > 0 else None
+
+    def get_stats(self) -> dict:
+        """
+        :return: history statistics: number of "versions", of distinct "bone_animations" they use, "memory_usage" (size
+                 of those bone animations) and "unshared_size" (size of all the versions, as if each one had its own
+                 copy of them)
+        """
+        return {
+            "versions": len(self._versions),
+            "bone_animations": len(self._bone_animations),
+            "memory_usage": sum(bone_animation.get_dump_size() for bone_animation in self._bone_animations.values()),
+            "unshared_size": sum(version.get_dump_size() for _, version in self._versions),
+        }
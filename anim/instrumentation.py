@@ -0,0 +1,176 @@
+"""
+This module provides an opt-in instrumentation of the anim package: time spent in each stage (file reads, parsing,
+keyframe decoding and encoding, scaling, joining, dumping, ...), counters (keyframes, bytes, ...) and per-bone hotspots
+(the bone animations that took the longest).
+It's enabled by setting the environment variable BT3_INSTRUMENTATION (to anything but "" or "0"), or by calling
+enable(). When disabled, each instrumented call only checks a flag.
+Stage times are inclusive: a stage that runs inside another one (eg. "encode" inside "dump") is counted in both.
+"""
+
+
+import os
+import json
+import time
+import functools
+from contextlib import contextmanager
+
+
+ENABLED = os.environ.get("BT3_INSTRUMENTATION", "") not in ("", "0")
+
+_stages = {}  # Stage name -> [calls, seconds]
+_counters = {}  # Counter name -> value
+_bone_hotspots = {}  # (stage name, bone ID) -> [calls, seconds, keyframes]
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def is_enabled() -> bool:
+    return ENABLED
+
+
+def reset():
+    """
+    Forget all the recorded data
+    """
+    _stages.clear()
+    _counters.clear()
+    _bone_hotspots.clear()
+
+
+def record_stage(stage: str, seconds: float):
+    """
+    Record a run of a stage
+    :param stage: Stage name
+    :param seconds: Time spent
+    """
+    stats = _stages.get(stage)
+    if stats is None:
+        _stages[stage] = [1, seconds]
+    else:
+        stats[0] += 1
+        stats[1] += seconds
+
+
+def count(counter: str, value: int = 1):
+    """
+    Increase a counter
+    :param counter: Counter name
+    :param value: Increment
+    """
+    _counters[counter] = _counters.get(counter, 0) + value
+
+
+def record_bone(stage: str, bone_id: int, seconds: float, keyframe_count: int):
+    """
+    Record the time spent on a bone animation during a stage
+    :param stage: Stage name
+    :param bone_id: Bone ID
+    :param seconds: Time spent
+    :param keyframe_count: Keyframes of the bone animation
+    """
+    stats = _bone_hotspots.get((stage, bone_id))
+    if stats is None:
+        _bone_hotspots[(stage, bone_id)] = [1, seconds, keyframe_count]
+    else:
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += keyframe_count
+
+
+def timed(stage: str):
+    """
+    Decorator that records the time spent in a function (if the instrumentation is enabled) as a stage
+    :param stage: Stage name
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            start_time = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record_stage(stage, time.perf_counter() - start_time)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Context manager that records the time spent in its block (if the instrumentation is enabled) as a stage
+    :param name: Stage name
+    """
+    if not ENABLED:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start_time)
+
+
+def run_on_bone(stage: str, bone_id: int, keyframe_count: int, function, *args):
+    """
+    Call function(*args), recording the time spent as a bone hotspot (if the instrumentation is enabled)
+    :param stage: Stage name
+    :param bone_id: Bone ID
+    :param keyframe_count: Keyframes of the bone animation
+    :return: the result of function
+    """
+    if not ENABLED:
+        return function(*args)
+    start_time = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        record_bone(stage, bone_id, time.perf_counter() - start_time, keyframe_count)
+
+
+def get_summary(hotspot_count: int = 10) -> dict:
+    """
+    :param hotspot_count: Number of bone hotspots to report (the slowest ones, None for all of them)
+    :return: all the recorded data, as a JSON-serializable dict
+    """
+    hotspots = sorted(_bone_hotspots.items(), key=lambda item: item[1][1], reverse=True)[:hotspot_count]
+    return {
+        "stages": {stage: {"calls": calls, "seconds": seconds} for stage, (calls, seconds) in _stages.items()},
+        "counters": dict(_counters),
+        "bone_hotspots": [
+            {"stage": stage, "bone_id": bone_id, "calls": calls, "seconds": seconds, "keyframes": keyframe_count}
+            for (stage, bone_id), (calls, seconds, keyframe_count) in hotspots
+        ],
+    }
+
+
+def merge_summary(summary: dict):
+    """
+    Add the data of a summary (eg. recorded by another process, see get_summary(...)) to the recorded data.
+    Only the bone hotspots in the summary are merged.
+    """
+    for stage, stats in summary["stages"].items():
+        record_stage(stage, stats["seconds"])
+        _stages[stage][0] += stats["calls"] - 1
+    for counter, value in summary["counters"].items():
+        count(counter, value)
+    for hotspot in summary["bone_hotspots"]:
+        record_bone(hotspot["stage"], hotspot["bone_id"], hotspot["seconds"], hotspot["keyframes"])
+        _bone_hotspots[(hotspot["stage"], hotspot["bone_id"])][0] += hotspot["calls"] - 1
+
+
+def export_summary(file_path: str, hotspot_count: int = 10):
+    """
+    Save the summary of the recorded data (see get_summary(...)) as a JSON file
+    """
+    with open(file_path, "w") as file:
+        json.dump(get_summary(hotspot_count), file, indent=2)
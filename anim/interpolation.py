@@ -0,0 +1,434 @@
+"""
+This module provides the decoding of rot_structs and the interpolation of keyframes (slerp for rotations, lerp for
+translations), working on whole blocks of keyframes at once. It also chooses the keyframes that can be dropped
+because they can be interpolated from the other ones (see select_kept_keyframes(...)).
+A rot_struct (8 bytes) is handled as a quaternion: 4 little-endian signed 16-bit fixed-point components (x, y, z, w).
+Interpolated rotations keep the magnitude of the fixed-point vectors (it's interpolated too), so the result doesn't
+depend on ROT_STRUCT_SCALE.
+If NumPy is available, big blocks are processed with vectorized operations. Otherwise (or for small blocks) the pure
+Python implementation is used.
+"""
+
+
+import math
+from bisect import bisect_right
+from array import array
+from myutils import codec
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Set to False to always use the pure Python implementation
+USE_NUMPY = numpy is not None
+
+# Minimum number of keyframes for which NumPy is used
+NUMPY_THRESHOLD = 64
+
+# Fixed-point scale of the rot_struct components
+ROT_STRUCT_SCALE = 32767.0
+
+_ROT_STRUCT_STRUCT = codec.get_struct("4h")
+
+# Above this cosine, slerp is replaced by a (normalized) lerp to avoid divisions by ~0
+_SLERP_DOT_THRESHOLD = 0.9995
+
+# Maximum number of keyframes that select_kept_keyframes(...) drops in a row: it bounds the cost of each check, so long
+# runs of keyframes within the tolerances don't take quadratic time
+MAX_DROPPED_RUN = 64
+
+# Number of run ends that select_kept_keyframes(...) checks at once with NumPy, at first (runs are often short)
+_NUMPY_FIRST_RUN_ENDS = 16
+
+
+def decode_rot_structs(rot_structs: bytes) -> list:
+    """
+    :param rot_structs: Contiguous rot_structs (8 bytes each)
+    :return: the rotations as a list of (x, y, z, w) quaternions
+    """
+    return [(x / ROT_STRUCT_SCALE, y / ROT_STRUCT_SCALE, z / ROT_STRUCT_SCALE, w / ROT_STRUCT_SCALE)
+            for x, y, z, w in _ROT_STRUCT_STRUCT.iter_unpack(rot_structs)]
+
+
+def encode_rotations(rotations) -> bytearray:
+    """
+    :param rotations: List of (x, y, z, w) quaternions
+    :return: the rot_structs (8 bytes each) of the rotations, as a single bytearray
+    """
+    if USE_NUMPY and len(rotations) >= NUMPY_THRESHOLD:
+        components = numpy.asarray(rotations, dtype=numpy.float64).reshape(len(rotations), 4)
+        return bytearray(numpy.clip(numpy.rint(components * ROT_STRUCT_SCALE), -32768, 32767).astype("<i2").tobytes())
+
+    return bytearray(codec.pack_many("h", [max(-32768, min(32767, round(component * ROT_STRUCT_SCALE)))
+                                           for rotation in rotations for component in rotation]))
+
+
+def slerp(q0: tuple, q1: tuple, t: float) -> tuple:
+    """
+    Spherical linear interpolation between two quaternions (along the shortest path). Their magnitudes are linearly
+    interpolated.
+    :param q0: First quaternion (x, y, z, w)
+    :param q1: Second quaternion (x, y, z, w)
+    :param t: Interpolation weight (0 -> q0, 1 -> q1)
+    :return: the interpolated quaternion
+    """
+    n0 = math.sqrt(sum(c * c for c in q0))
+    n1 = math.sqrt(sum(c * c for c in q1))
+    if n0 == 0 or n1 == 0:
+        return tuple(c0 + (c1 - c0) * t for c0, c1 in zip(q0, q1))
+    u0 = [c / n0 for c in q0]
+    u1 = [c / n1 for c in q1]
+    dot = sum(c0 * c1 for c0, c1 in zip(u0, u1))
+    if dot < 0:
+        u1 = [-c for c in u1]
+        dot = -dot
+    if dot > _SLERP_DOT_THRESHOLD:
+        u = [c0 + (c1 - c0) * t for c0, c1 in zip(u0, u1)]
+        norm = math.sqrt(sum(c * c for c in u))
+        u = [c / norm for c in u]
+    else:
+        theta = math.acos(dot)
+        sin_theta = math.sin(theta)
+        w0 = math.sin((1 - t) * theta) / sin_theta
+        w1 = math.sin(t * theta) / sin_theta
+        u = [w0 * c0 + w1 * c1 for c0, c1 in zip(u0, u1)]
+    norm = n0 + (n1 - n0) * t
+    return tuple(c * norm for c in u)
+
+
+def rotation_angle(q0: tuple, q1: tuple) -> float:
+    """
+    :return: the angle (radians) of the rotation between two quaternions (their magnitudes are ignored)
+    """
+    n0 = math.sqrt(sum(c * c for c in q0))
+    n1 = math.sqrt(sum(c * c for c in q1))
+    if n0 == 0 or n1 == 0:
+        return 0.0 if n0 == n1 else math.pi
+    dot = abs(sum(c0 * c1 for c0, c1 in zip(q0, q1))) / (n0 * n1)
+    return 2 * math.acos(min(1.0, dot))
+
+
+def _slerp_numpy(q0, q1, t):
+    """
+    Vectorized slerp(...): q0 and q1 are (n, 4) arrays, t is a (n, ) array
+    """
+    t = t[:, None]
+    n0 = numpy.linalg.norm(q0, axis=1, keepdims=True)
+    n1 = numpy.linalg.norm(q1, axis=1, keepdims=True)
+    degenerate = ((n0 == 0) | (n1 == 0))[:, 0]
+    u0 = q0 / numpy.where(n0 == 0, 1, n0)
+    u1 = q1 / numpy.where(n1 == 0, 1, n1)
+    dot = numpy.sum(u0 * u1, axis=1, keepdims=True)
+    u1 = numpy.where(dot < 0, -u1, u1)
+    dot = numpy.abs(dot)
+
+    # Normalized lerp where the quaternions are almost the same, slerp elsewhere
+    close = dot > _SLERP_DOT_THRESHOLD
+    theta = numpy.arccos(numpy.clip(dot, -1, 1))
+    sin_theta = numpy.where(close, 1, numpy.sin(theta))
+    w0 = numpy.where(close, 1 - t, numpy.sin((1 - t) * theta) / sin_theta)
+    w1 = numpy.where(close, t, numpy.sin(t * theta) / sin_theta)
+    u = w0 * u0 + w1 * u1
+    u_norm = numpy.linalg.norm(u, axis=1, keepdims=True)
+    u = u / numpy.where(u_norm == 0, 1, u_norm)
+
+    result = u * (n0 + (n1 - n0) * t)
+    result[degenerate] = (q0 + (q1 - q0) * t)[degenerate]
+    return result
+
+
+def locate(timestamps, times) -> tuple:
+    """
+    Find where each time falls among the (sorted) keyframe timestamps
+    :param timestamps: Keyframe timestamps (sorted)
+    :param times: Times to locate (they don't need to be integers)
+    :return: two lists: for each time, the index i of the keyframe before it and the interpolation weight between
+             keyframe i and keyframe i + 1 (0 exactly on a keyframe, and before the first or after the last keyframe)
+    """
+    last = len(timestamps) - 1
+    indices = []
+    weights = []
+    for time in times:
+        i = bisect_right(timestamps, time) - 1
+        if i < 0:
+            indices.append(0)
+            weights.append(0.0)
+        elif i >= last:
+            indices.append(last)
+            weights.append(0.0)
+        else:
+            indices.append(i)
+            weights.append((time - timestamps[i]) / (timestamps[i + 1] - timestamps[i]))
+    return indices, weights
+
+
+def interpolate_rot_structs(rot_structs: bytes, indices: list, weights: list) -> bytearray:
+    """
+    Compute new rot_structs, each one interpolating (slerp) rot_structs[i] and rot_structs[i + 1] (see locate(...)).
+    Where the weight is 0, the original rot_struct is copied as is.
+    :param rot_structs: Contiguous rot_structs (8 bytes each)
+    :param indices: Index of the first rot_struct of each interpolation
+    :param weights: Weight of each interpolation
+    :return: the new rot_structs
+    """
+    size = _ROT_STRUCT_STRUCT.size
+    count = len(rot_structs) // size
+
+    if USE_NUMPY and len(indices) >= NUMPY_THRESHOLD:
+        components = numpy.frombuffer(bytes(rot_structs), dtype="<i2").reshape(count, 4)
+        indices = numpy.asarray(indices, dtype=numpy.intp)
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        rotations = components / ROT_STRUCT_SCALE
+        interpolated = _slerp_numpy(rotations[indices], rotations[numpy.minimum(indices + 1, count - 1)], weights)
+        encoded = numpy.clip(numpy.rint(interpolated * ROT_STRUCT_SCALE), -32768, 32767).astype("<i2")
+        encoded = numpy.where((weights == 0)[:, None], components[indices], encoded)
+        return bytearray(encoded.tobytes())
+
+    rotations = decode_rot_structs(rot_structs)
+    interpolated = bytearray()
+    for i, weight in zip(indices, weights):
+        if weight == 0:
+            interpolated += rot_structs[i * size:(i + 1) * size]
+        else:
+            interpolated += encode_rotations([slerp(rotations[i], rotations[i + 1], weight)])
+    return interpolated
+
+
+def interpolate_rotations(rotations: list, indices: list, weights: list) -> list:
+    """
+    Like interpolate_rot_structs(...), but on decoded rotations (see decode_rot_structs(...)), without rounding them
+    to the fixed-point form
+    :param rotations: List of (x, y, z, w) quaternions
+    :param indices: Index of the first rotation of each interpolation
+    :param weights: Weight of each interpolation
+    :return: the interpolated rotations, as a list of (x, y, z, w) quaternions
+    """
+    count = len(rotations)
+
+    if USE_NUMPY and len(indices) >= NUMPY_THRESHOLD:
+        quaternions = numpy.asarray(rotations, dtype=numpy.float64).reshape(count, 4)
+        indices = numpy.asarray(indices, dtype=numpy.intp)
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+        interpolated = _slerp_numpy(quaternions[indices], quaternions[numpy.minimum(indices + 1, count - 1)], weights)
+        interpolated = numpy.where((weights == 0)[:, None], quaternions[indices], interpolated)
+        return [tuple(rotation) for rotation in interpolated.tolist()]
+
+    return [rotations[i] if weight == 0 else slerp(rotations[i], rotations[i + 1], weight)
+            for i, weight in zip(indices, weights)]
+
+
+def interpolate_translations(translations: array, indices: list, weights: list) -> array:
+    """
+    Compute new translations, each one interpolating (lerp) translation i and i + 1 (see locate(...))
+    :param translations: Translations (x, y, z for each keyframe, array of "f")
+    :param indices: Index of the first translation of each interpolation
+    :param weights: Weight of each interpolation
+    :return: the new translations (array of "f")
+    """
+    count = len(translations) // 3
+
+    if USE_NUMPY and len(indices) >= NUMPY_THRESHOLD:
+        vectors = numpy.frombuffer(translations, dtype=numpy.float32).reshape(count, 3).astype(numpy.float64)
+        indices = numpy.asarray(indices, dtype=numpy.intp)
+        weights = numpy.asarray(weights, dtype=numpy.float64)[:, None]
+        v0 = vectors[indices]
+        v1 = vectors[numpy.minimum(indices + 1, count - 1)]
+        interpolated = array("f")
+        interpolated.frombytes((v0 + (v1 - v0) * weights).astype(numpy.float32).tobytes())
+        return interpolated
+
+    interpolated = array("f")
+    for i, weight in zip(indices, weights):
+        v0 = translations[i * 3:i * 3 + 3]
+        if weight == 0:
+            interpolated.extend(v0)
+            continue
+        v1 = translations[i * 3 + 3:i * 3 + 6]
+        interpolated.extend([c0 + (c1 - c0) * weight for c0, c1 in zip(v0, v1)])
+    return interpolated
+
+
+def _normalize(q: tuple):
+    """
+    :return: q divided by its magnitude (None if it's 0)
+    """
+    norm = math.sqrt(q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3])
+    return (q[0] / norm, q[1] / norm, q[2] / norm, q[3] / norm) if norm > 0 else None
+
+
+def _is_run_interpolable(first: int, last: int, timestamps, rot_structs: bytes, rotations: list, units: list,
+                         translations, angular_tolerance: float, positional_tolerance: float) -> bool:
+    """
+    :param units: rotations normalized (see _normalize(...))
+    :return: True if all the keyframes between first and last (excluded) are within the tolerances from the
+             interpolation of keyframes first and last (see select_kept_keyframes(...))
+    """
+    size = _ROT_STRUCT_STRUCT.size
+    first_rot_struct = rot_structs[first * size:(first + 1) * size]
+    last_rot_struct = rot_structs[last * size:(last + 1) * size]
+    first_timestamp = timestamps[first]
+    duration = timestamps[last] - first_timestamp
+
+    # Same as slerp(...) and rotation_angle(...), but what depends only on the ends of the run is computed once, and
+    # angles are compared through their cosines. Magnitudes don't matter, so the unit quaternions are interpolated
+    u0 = units[first]
+    u1 = units[last]
+    cos_limit = math.cos(angular_tolerance / 2)
+    slerp_setup = None
+    if u0 is not None and u1 is not None:
+        dot = u0[0] * u1[0] + u0[1] * u1[1] + u0[2] * u1[2] + u0[3] * u1[3]
+        if dot < 0:
+            u1 = (-u1[0], -u1[1], -u1[2], -u1[3])
+            dot = -dot
+        theta = math.acos(dot) if dot <= _SLERP_DOT_THRESHOLD else None
+        slerp_setup = theta, math.sin(theta) if theta is not None else None
+
+    x0, y0, z0 = translations[first * 3:first * 3 + 3] if translations is not None else (0.0, 0.0, 0.0)
+    x1, y1, z1 = translations[last * 3:last * 3 + 3] if translations is not None else (0.0, 0.0, 0.0)
+    for j in range(first + 1, last):
+        weight = (timestamps[j] - first_timestamp) / duration if duration > 0 else 0.0
+
+        rot_struct = rot_structs[j * size:(j + 1) * size]
+        if rot_struct != first_rot_struct or rot_struct != last_rot_struct:
+            if angular_tolerance <= 0:
+                return False
+            uj = units[j]
+            if slerp_setup is None or uj is None:
+                interpolated = slerp(rotations[first], rotations[last], weight)
+                if rotation_angle(interpolated, rotations[j]) > angular_tolerance:
+                    return False
+            else:
+                theta, sin_theta = slerp_setup
+                if theta is None:
+                    w0, w1 = 1 - weight, weight
+                else:
+                    w0, w1 = math.sin((1 - weight) * theta) / sin_theta, math.sin(weight * theta) / sin_theta
+                u = (w0 * u0[0] + w1 * u1[0], w0 * u0[1] + w1 * u1[1], w0 * u0[2] + w1 * u1[2],
+                     w0 * u0[3] + w1 * u1[3])
+                norm = math.sqrt(u[0] * u[0] + u[1] * u[1] + u[2] * u[2] + u[3] * u[3])
+                cos_half_angle = abs(u[0] * uj[0] + u[1] * uj[1] + u[2] * uj[2] + u[3] * uj[3]) / norm \
+                    if norm > 0 else 0.0
+                if min(1.0, cos_half_angle) < cos_limit:
+                    return False
+
+        if translations is not None:
+            dx = x0 + (x1 - x0) * weight - translations[j * 3]
+            dy = y0 + (y1 - y0) * weight - translations[j * 3 + 1]
+            dz = z0 + (z1 - z0) * weight - translations[j * 3 + 2]
+            if math.sqrt(dx * dx + dy * dy + dz * dz) > positional_tolerance:
+                return False
+    return True
+
+
+def _find_failing_run_end_numpy(first: int, ends: range, timestamps, rot_struct_ids, quaternions, vectors,
+                                angular_tolerance: float, positional_tolerance: float):
+    """
+    Vectorized _is_run_interpolable(...) on many runs at once, all starting from keyframe first: timestamps is a (n, )
+    array, rot_struct_ids a (n, ) array of the rot_structs as integers (to compare them), quaternions a (n, 4) array,
+    vectors a (n, 3) array (None for keyframes type 1)
+    :return: the first of ends for which the run from first to it can't be interpolated (None if all of them can)
+    """
+    # Row: a run end, column: a keyframe inside the runs (only the ones before the end of the row are checked)
+    last = numpy.arange(ends.start, ends.stop)[:, None]
+    inside = numpy.arange(first + 1, ends.stop - 1)[None, :]
+    checked = inside < last
+    inside = numpy.broadcast_to(inside, checked.shape)
+    durations = timestamps[last] - timestamps[first]
+    weights = (timestamps[inside] - timestamps[first]) / numpy.where(durations > 0, durations, 1)
+    weights = numpy.where(durations > 0, weights, 0.0)
+    failed = numpy.zeros(checked.shape, dtype=bool)
+
+    inside_ids = rot_struct_ids[inside]
+    changed = checked & ((inside_ids != rot_struct_ids[first]) | (inside_ids != rot_struct_ids[last]))
+    if changed.any():
+        if angular_tolerance <= 0:
+            failed |= changed
+        else:
+            q0 = numpy.broadcast_to(quaternions[first], (int(changed.sum()), 4))
+            q1 = quaternions[numpy.broadcast_to(last, checked.shape)[changed]]
+            interpolated = _slerp_numpy(q0, q1, weights[changed])
+            rotations = quaternions[inside[changed]]
+
+            # Vectorized rotation_angle(...)
+            n0 = numpy.linalg.norm(interpolated, axis=1)
+            n1 = numpy.linalg.norm(rotations, axis=1)
+            degenerate = (n0 == 0) | (n1 == 0)
+            dot = numpy.abs(numpy.sum(interpolated * rotations, axis=1)) / numpy.where(degenerate, 1, n0 * n1)
+            angles = numpy.where(degenerate, numpy.where(n0 == n1, 0.0, math.pi),
+                                 2 * numpy.arccos(numpy.minimum(1.0, dot)))
+            failed[changed] = angles > angular_tolerance
+
+    if vectors is not None:
+        v0 = vectors[first]
+        interpolated = v0 + (vectors[last] - v0) * weights[:, :, None]
+        errors = numpy.linalg.norm(interpolated - vectors[inside], axis=2)
+        failed |= checked & (errors > positional_tolerance)
+
+    failed_rows = numpy.flatnonzero(failed.any(axis=1))
+    return ends.start + int(failed_rows[0]) if len(failed_rows) > 0 else None
+
+
+def select_kept_keyframes(timestamps, rot_structs: bytes, translations, angular_tolerance: float = 0.0,
+                          positional_tolerance: float = 0.0) -> list:
+    """
+    Choose the keyframes to keep, so that the other ones can be computed by interpolating the kept ones around them
+    (slerp for rotations, lerp for translations) within the tolerances. Keyframes are scanned in order, and each one is
+    dropped if the keyframes from the last kept one to the next one can be interpolated without it (and no more than
+    MAX_DROPPED_RUN keyframes have been dropped in a row). The first and the last keyframes are always kept.
+    A keyframe whose rot_struct is the same of the kept ones around it always matches, even with angular_tolerance 0.
+    With NumPy, the runs from a kept keyframe to the next candidates are checked all at once.
+    :param timestamps: Keyframe timestamps
+    :param rot_structs: Contiguous rot_structs (8 bytes each)
+    :param translations: Translations (x, y, z for each keyframe, array of "f"). None for keyframes type 1
+    :param angular_tolerance: Maximum rotation error (radians)
+    :param positional_tolerance: Maximum translation error (distance)
+    :return: the indices of the kept keyframes, sorted
+    """
+    count = len(timestamps)
+    if count <= 2:
+        return list(range(count))
+    rotations = decode_rot_structs(rot_structs)
+
+    if not USE_NUMPY or count < NUMPY_THRESHOLD:
+        units = [_normalize(rotation) for rotation in rotations]
+        kept = [0]
+        for i in range(1, count - 1):
+            # Keep keyframe i if the keyframes from the last kept one to i + 1 can't be interpolated without it
+            if i - kept[-1] > MAX_DROPPED_RUN or not _is_run_interpolable(
+                    kept[-1], i + 1, timestamps, rot_structs, rotations, units, translations, angular_tolerance,
+                    positional_tolerance):
+                kept.append(i)
+        kept.append(count - 1)
+        return kept
+
+    run_check_args = (
+        numpy.asarray(timestamps, dtype=numpy.float64),
+        numpy.frombuffer(bytes(rot_structs), dtype=numpy.uint64),
+        numpy.asarray(rotations, dtype=numpy.float64).reshape(count, 4),
+        None if translations is None
+        else numpy.frombuffer(translations, dtype=numpy.float32).reshape(count, 3).astype(numpy.float64),
+        angular_tolerance, positional_tolerance,
+    )
+    kept = [0]
+    while kept[-1] < count - 2:
+        # Same as above: find the first run end i + 1 that fails, checking a few run ends first and then the others
+        first = kept[-1]
+        last_end = min(first + MAX_DROPPED_RUN + 1, count - 1)
+        failing_end = None
+        start = first + 2
+        for stop in (min(first + 2 + _NUMPY_FIRST_RUN_ENDS, last_end + 1), last_end + 1):
+            if start < stop:
+                failing_end = _find_failing_run_end_numpy(first, range(start, stop), *run_check_args)
+                if failing_end is not None:
+                    break
+            start = stop
+        if failing_end is not None:
+            kept.append(failing_end - 1)
+        elif last_end < count - 1:
+            kept.append(last_end)
+        else:
+            break
+    kept.append(count - 1)
+    return kept
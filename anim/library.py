@@ -0,0 +1,300 @@
+"""
+This module provides a persistent index of an animation library (a directory tree of animation files), to find the
+animations that animate some bones, or have a given magic or frame count, without loading any of them.
+Only the header of each file is read (magic, frame count, bone animation offsets) plus the type and the keyframe count
+of each bone animation (see read_animation_info(...)). The index is updated incrementally: only the files whose
+modification time or size changed are read again.
+"""
+
+
+import os
+import struct
+from array import array
+from myutils import codec
+from anim.bt3animation import Animation, read_animation_info, make_bone_mask, get_bone_mask_bones
+from anim.paths import expand_paths
+
+
+INDEX_FILE_NAME = ".bt3index"
+
+_INDEX_MAGIC = b"BT3I"
+_INDEX_VERSION = 1
+_INDEX_HEADER_STRUCT = codec.get_struct("4sHI")  # Magic, version, entry count
+_ENTRY_STRUCT = codec.get_struct("HqIHH")  # Path length, modification time (ns), size, magic, frame count
+
+# Bone type of the bones that are not animated (in LibraryEntry._bone_types)
+_NOT_ANIMATED = 0xFF
+
+
+class LibraryEntry:
+    """
+    What the index knows about an animation file
+    """
+
+    __slots__ = ("_path", "_mtime_ns", "_size", "_magic", "_frame_count", "_bone_types", "_keyframe_counts",
+                 "_bone_mask", "_type0_mask")
+
+    def __init__(self, path: str, mtime_ns: int, size: int, magic: int, frame_count: int, bone_types: bytes,
+                 keyframe_counts: array):
+        """
+        Constructor
+        :param path: File path, relative to the library root
+        :param mtime_ns: Modification time of the file (ns)
+        :param size: File size
+        :param magic: "Magic" number of the animation
+        :param frame_count: Frame count of the animation
+        :param bone_types: Type of each bone animation (_NOT_ANIMATED for bones that are not animated)
+        :param keyframe_counts: Keyframe count of each bone animation (array of "H", 0 for bones that are not animated)
+        """
+        self._path = path
+        self._mtime_ns = mtime_ns
+        self._size = size
+        self._magic = magic
+        self._frame_count = frame_count
+        self._bone_types = bone_types
+        self._keyframe_counts = keyframe_counts
+
+        # Masks make queries on bones cheap
+        self._bone_mask = 0
+        self._type0_mask = 0
+        for bone_id, bone_type in enumerate(bone_types):
+            if bone_type != _NOT_ANIMATED:
+                self._bone_mask |= 1 << bone_id
+                if bone_type == 0:
+                    self._type0_mask |= 1 << bone_id
+
+    def get_path(self) -> str:
+        """
+        :return: the file path, relative to the library root
+        """
+        return self._path
+
+    def get_mtime_ns(self) -> int:
+        return self._mtime_ns
+
+    def get_size(self) -> int:
+        return self._size
+
+    def get_magic(self) -> int:
+        return self._magic
+
+    def get_frame_count(self) -> int:
+        return self._frame_count
+
+    def get_animated_bone_mask(self) -> int:
+        return self._bone_mask
+
+    def get_animated_bones(self) -> list:
+        """
+        :return: the IDs of the animated bones
+        """
+        return get_bone_mask_bones(self._bone_mask)
+
+    def get_bone_type(self, bone_id: int):
+        """
+        :return: the type of the bone animation (None if the bone is not animated)
+        """
+        return self._bone_types[bone_id] if self._bone_types[bone_id] != _NOT_ANIMATED else None
+
+    def get_bone_keyframe_count(self, bone_id: int) -> int:
+        """
+        :return: the keyframe count of the bone animation (0 if the bone is not animated)
+        """
+        return self._keyframe_counts[bone_id]
+
+    def get_keyframe_count(self) -> int:
+        """
+        :return: the total keyframe count of the animation
+        """
+        return sum(self._keyframe_counts)
+
+    def matches(self, bone_mask: int = 0, bone_type: int = None, frame_count: int = None, magic: int = None) -> bool:
+        """
+        See LibraryIndex.query(...)
+        """
+        if frame_count is not None and self._frame_count != frame_count:
+            return False
+        if magic is not None and self._magic != magic:
+            return False
+        if self._bone_mask & bone_mask != bone_mask:
+            return False
+        if bone_type == 0:
+            return self._type0_mask & bone_mask == bone_mask
+        if bone_type == 1:
+            return self._type0_mask & bone_mask == 0
+        return True
+
+    def dump(self) -> bytes:
+        """
+        :return: the binary form of the entry (in the index file)
+        """
+        path = self._path.encode("utf-8")
+        return (_ENTRY_STRUCT.pack(len(path), self._mtime_ns, self._size, self._magic, self._frame_count) + path
+                + self._bone_types + codec.pack_many("H", self._keyframe_counts))
+
+    @staticmethod
+    def from_dump(dump, offset: int) -> tuple:
+        """
+        Read an entry from the binary form of an index
+        :param dump: Index file dump
+        :param offset: Offset of the entry inside the dump
+        :return: the entry, and the offset of the next one
+        """
+        path_size, mtime_ns, size, magic, frame_count = _ENTRY_STRUCT.unpack_from(dump, offset)
+        offset += _ENTRY_STRUCT.size
+        path = bytes(dump[offset:offset + path_size]).decode("utf-8")
+        offset += path_size
+        bone_types = bytes(dump[offset:offset + Animation.BONE_COUNT])
+        offset += Animation.BONE_COUNT
+        keyframe_counts = codec.unpack_many("H", dump[offset:offset + Animation.BONE_COUNT * 2])
+        offset += Animation.BONE_COUNT * 2
+        if len(bone_types) != Animation.BONE_COUNT or len(keyframe_counts) != Animation.BONE_COUNT:
+            raise ValueError("LibraryEntry -> from_dump(...) -> Error: truncated entry")
+        return LibraryEntry(path, mtime_ns, size, magic, frame_count, bone_types, keyframe_counts), offset
+
+
+class LibraryIndex:
+    """
+    Persistent index of the animation files inside a directory tree.
+    Entries are kept in memory, sorted by path; the index file is only a snapshot of them, written by save(). If the
+    index file is missing, unreadable or of another version, the index starts empty (the next update() rebuilds it).
+    """
+
+    def __init__(self, root_dir: str, index_path: str = None):
+        """
+        Constructor. The index file is loaded, if present.
+        :param root_dir: Root directory of the library
+        :param index_path: Index file path (default: INDEX_FILE_NAME inside root_dir)
+        """
+        self._root_dir = root_dir
+        self._index_path = index_path if index_path is not None else os.path.join(root_dir, INDEX_FILE_NAME)
+        self._entries = {}  # Relative file path -> LibraryEntry
+
+        try:
+            with open(self._index_path, "rb") as file:
+                dump = file.read()
+            self._entries = self._parse(dump)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def _parse(dump: bytes) -> dict:
+        """
+        :return: the entries of an index file dump
+        :raise ValueError: if the dump is not a valid index (of this version)
+        """
+        if len(dump) < _INDEX_HEADER_STRUCT.size:
+            raise ValueError("LibraryIndex -> _parse(...) -> Error: index too short")
+        magic, version, entry_count = _INDEX_HEADER_STRUCT.unpack_from(dump)
+        if magic != _INDEX_MAGIC or version != _INDEX_VERSION:
+            raise ValueError(f"LibraryIndex -> _parse(...) -> Error: unknown index format ({magic}, {version})")
+
+        entries = {}
+        dump_view = memoryview(dump)
+        offset = _INDEX_HEADER_STRUCT.size
+        try:
+            for _ in range(entry_count):
+                entry, offset = LibraryEntry.from_dump(dump_view, offset)
+                entries[entry.get_path()] = entry
+        except (UnicodeDecodeError, struct.error) as e:
+            raise ValueError(f"LibraryIndex -> _parse(...) -> Error: invalid entry ({e})")
+        return entries
+
+    def get_root_dir(self) -> str:
+        return self._root_dir
+
+    def get_index_path(self) -> str:
+        return self._index_path
+
+    def get_entry_count(self) -> int:
+        return len(self._entries)
+
+    def get_entries(self) -> list:
+        """
+        :return: all the entries, sorted by path
+        """
+        return list(self._entries.values())
+
+    def get_entry(self, file_path: str):
+        """
+        :param file_path: File path, relative to the library root
+        :return: the entry of the file (None if it's not in the index)
+        """
+        return self._entries.get(file_path)
+
+    def get_file_path(self, entry: LibraryEntry) -> str:
+        """
+        :return: the path of the file of an entry (not relative to the library root)
+        """
+        return os.path.join(self._root_dir, entry.get_path())
+
+    def _read_entry(self, path: str, stat: os.stat_result) -> LibraryEntry:
+        """
+        Read the header of an animation file
+        :raise InvalidAnimationError: if the file is not a valid animation
+        """
+        info = read_animation_info(os.path.join(self._root_dir, path), bone_headers=True)
+        bone_types = bytes(info.get_bone_type(bone_id) if info.get_bone_type(bone_id) is not None else _NOT_ANIMATED
+                           for bone_id in range(Animation.BONE_COUNT))
+        keyframe_counts = array("H", [info.get_bone_keyframe_count(bone_id) or 0
+                                      for bone_id in range(Animation.BONE_COUNT)])
+        return LibraryEntry(path, stat.st_mtime_ns, stat.st_size, info.get_magic(), info.get_frame_count(), bone_types,
+                            keyframe_counts)
+
+    def update(self) -> dict:
+        """
+        Scan the library: files added or changed (different modification time or size) since the last update are
+        read, the entries of deleted or invalid files are removed
+        :return: the number of entries "added", "updated", "removed" and "unchanged", and the "errors" (list of
+                 (file path, error message) tuples)
+        """
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "errors": []}
+        entries = {}
+        for file_path in expand_paths([self._root_dir]):
+            path = os.path.relpath(file_path, self._root_dir)
+            try:
+                stat = os.stat(file_path)
+                old_entry = self._entries.get(path)
+                if old_entry is not None and old_entry.get_mtime_ns() == stat.st_mtime_ns \
+                        and old_entry.get_size() == stat.st_size:
+                    entries[path] = old_entry
+                    stats["unchanged"] += 1
+                    continue
+                entries[path] = self._read_entry(path, stat)
+                stats["added" if old_entry is None else "updated"] += 1
+            except Exception as e:
+                stats["errors"].append((file_path, f"{type(e).__name__}: {e}"))
+
+        stats["removed"] = len([path for path in self._entries if path not in entries])
+        self._entries = entries
+        return stats
+
+    def save(self):
+        """
+        Write the index file (atomically: a temporary file replaces it)
+        """
+        temp_index_path = self._index_path + ".tmp"
+        with open(temp_index_path, "wb") as file:
+            file.write(_INDEX_HEADER_STRUCT.pack(_INDEX_MAGIC, _INDEX_VERSION, len(self._entries)))
+            file.writelines(entry.dump() for entry in self._entries.values())
+        os.replace(temp_index_path, self._index_path)
+
+    def query(self, bones: list = None, bone_type: int = None, frame_count: int = None, magic: int = None) -> list:
+        """
+        Find the animations that match all the given conditions (None for no condition), eg. all animations with bone
+        0x15 of type 0 and 40 frames: query([0x15], 0, 40)
+        :param bones: Bones (IDs) that must be animated
+        :param bone_type: Type that the bone animations of bones must have
+        :param frame_count: Frame count
+        :param magic: "Magic" number
+        :return: the matching entries, sorted by path
+        :raise InvalidBoneIdError: if bones contains an invalid bone ID
+        :raise ValueError: if bone_type is not 0 or 1, or it's given without bones
+        """
+        if bone_type is not None:
+            if bone_type != 0 and bone_type != 1:
+                raise ValueError(f"LibraryIndex -> query(...) -> Error: invalid bone type ({bone_type})")
+            if not bones:
+                raise ValueError("LibraryIndex -> query(...) -> Error: a bone type needs the bones it applies to")
+        bone_mask = make_bone_mask(bones) if bones is not None else 0
+        return [entry for entry in self._entries.values() if entry.matches(bone_mask, bone_type, frame_count, magic)]
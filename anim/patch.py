@@ -0,0 +1,184 @@
+"""
+This module computes compact patches between an original animation and an edited one, and applies them: the result
+is byte-for-byte the dump() of the edited animation.
+Bone animations are compared one by one, and each changed one is stored as the cheapest operation that rebuilds it
+from the original bone animation:
+- remove: the bone is not animated anymore
+- scale: the original bone animation, scaled from the original frame count to the new one (see
+  BoneAnimation.scale_timestamps_according_to_frame_count(...))
+- timestamps: the original keyframes, with new timestamps (2 bytes each)
+- replace: a whole new bone animation (eg. imported from another animation)
+Unchanged bone animations cost nothing.
+
+Patch format (little-endian):
+- header: magic "BT3P", version (u8), flags (u8), SHA-256 of the original and of the edited animation (see
+  Animation.digest()), magic (u16) and frame count (u16) of the edited animation, size of its other header info (u16),
+  number of operations (u16)
+- other header info of the edited animation
+- operations (zlib-compressed if flags has _FLAG_COMPRESSED): bone ID (u8), operation (u8), then for replace the size
+  (u32) and the binary form of the new bone animation, for timestamps the new timestamps (u16 each, as many as the
+  keyframes of the original bone animation)
+"""
+
+
+import zlib
+import struct
+from myutils import codec
+from anim.bt3animation import Animation, AnimationError
+
+
+PATCH_FILE_EXTENSION = ".bt3patch"
+
+_PATCH_MAGIC = b"BT3P"
+_PATCH_VERSION = 1
+_PATCH_HEADER_STRUCT = codec.get_struct("4sBB32s32sHHHH")
+_OPERATION_STRUCT = codec.get_struct("BB")  # Bone ID, operation
+_SIZE_STRUCT = codec.get_struct("I")
+
+_FLAG_COMPRESSED = 1
+
+_OPERATION_REMOVE = 0
+_OPERATION_REPLACE = 1
+_OPERATION_SCALE = 2
+_OPERATION_TIMESTAMPS = 3
+
+
+class InvalidPatchError(AnimationError):
+    """
+    The patch is not valid, or it's not for the given animation
+    """
+    pass
+
+
+def _diff_bone_animation(original_bone_animation, target_bone_animation, original_frame_count: int,
+                         target_frame_count: int) -> tuple:
+    """
+    :return: the cheapest operation that rebuilds target_bone_animation from original_bone_animation, and its data
+             (None if the bone animations are the same)
+    """
+    if target_bone_animation is None:
+        return _OPERATION_REMOVE, b""
+    replace_operation = _OPERATION_REPLACE, \
+        _SIZE_STRUCT.pack(target_bone_animation.get_dump_size()) + target_bone_animation.dump()
+    if original_bone_animation is None or original_bone_animation.get_type() != target_bone_animation.get_type() \
+            or original_bone_animation.get_keyframe_count() != target_bone_animation.get_keyframe_count():
+        return replace_operation
+    target_digest = target_bone_animation.digest()
+    if original_bone_animation.digest() == target_digest:
+        return None
+
+    scaled_bone_animation = original_bone_animation.copy()
+    scaled_bone_animation.scale_timestamps_according_to_frame_count(original_frame_count, target_frame_count)
+    if scaled_bone_animation.digest() == target_digest:
+        return _OPERATION_SCALE, b""
+
+    timestamps = target_bone_animation.copy_timestamps()
+    if max(timestamps, default=0) <= 0xFFFF:
+        retimed_bone_animation = original_bone_animation.copy()
+        retimed_bone_animation.set_timestamps(timestamps)
+        if retimed_bone_animation.digest() == target_digest:
+            return _OPERATION_TIMESTAMPS, codec.pack_many("H", timestamps)
+
+    return replace_operation
+
+
+def diff_animations(original_animation: Animation, target_animation: Animation) -> bytes:
+    """
+    Compute the patch that turns original_animation into target_animation (none of them is changed)
+    :param original_animation: The original animation
+    :param target_animation: The edited animation
+    :return: the patch
+    """
+    original_bone_animations = original_animation.get_bone_animations()
+    target_bone_animations = target_animation.get_bone_animations()
+    operations = []
+    for bone_id in range(Animation.BONE_COUNT):
+        if original_bone_animations[bone_id] is None and target_bone_animations[bone_id] is None:
+            continue
+        operation = _diff_bone_animation(original_bone_animations[bone_id], target_bone_animations[bone_id],
+                                         original_animation.get_frame_count(), target_animation.get_frame_count())
+        if operation is not None:
+            operations.append(_OPERATION_STRUCT.pack(bone_id, operation[0]) + operation[1])
+
+    body = b"".join(operations)
+    compressed_body = zlib.compress(body, 9)
+    flags = 0
+    if len(compressed_body) < len(body):
+        body = compressed_body
+        flags |= _FLAG_COMPRESSED
+
+    header_rem = target_animation.get_header_rem()
+    header = _PATCH_HEADER_STRUCT.pack(
+        _PATCH_MAGIC, _PATCH_VERSION, flags, bytes.fromhex(original_animation.digest()),
+        bytes.fromhex(target_animation.digest()), target_animation.get_magic(), target_animation.get_frame_count(),
+        len(header_rem), len(operations)
+    )
+    return header + header_rem + body
+
+
+def apply_patch(original_animation: Animation, patch: bytes) -> Animation:
+    """
+    Apply a patch (see diff_animations(...)) to the animation it was computed from
+    :param original_animation: The original animation (it's not changed)
+    :param patch: The patch
+    :return: the edited animation: its dump() is byte-for-byte the one of the animation the patch was computed to
+    :raise InvalidPatchError: if the patch is not valid, it's for another animation, or the result doesn't match the
+                              patch checksum
+    """
+    if len(patch) < _PATCH_HEADER_STRUCT.size:
+        raise InvalidPatchError(f"apply_patch(...) -> Error: patch too short ({len(patch)} bytes)")
+    magic, version, flags, original_digest, target_digest, target_magic, target_frame_count, header_rem_size, \
+        operation_count = _PATCH_HEADER_STRUCT.unpack_from(patch)
+    if magic != _PATCH_MAGIC or version != _PATCH_VERSION:
+        raise InvalidPatchError(f"apply_patch(...) -> Error: unknown patch format ({magic}, {version})")
+    if bytes.fromhex(original_animation.digest()) != original_digest:
+        raise InvalidPatchError("apply_patch(...) -> Error: the patch is for another animation")
+
+    cursor = _PATCH_HEADER_STRUCT.size
+    header_rem = bytes(patch[cursor:cursor + header_rem_size])
+    body = patch[cursor + header_rem_size:]
+    if flags & _FLAG_COMPRESSED:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error as e:
+            raise InvalidPatchError(f"apply_patch(...) -> Error: corrupted patch ({e})")
+
+    original_bone_animations = original_animation.get_bone_animations()
+    bone_segments = [None if bone_animation is None else bone_animation.dump()
+                     for bone_animation in original_bone_animations]
+    cursor = 0
+    try:
+        for _ in range(operation_count):
+            bone_id, operation = _OPERATION_STRUCT.unpack_from(body, cursor)
+            cursor += _OPERATION_STRUCT.size
+            if operation == _OPERATION_REMOVE:
+                bone_segments[bone_id] = None
+            elif operation == _OPERATION_REPLACE:
+                size, = _SIZE_STRUCT.unpack_from(body, cursor)
+                cursor += _SIZE_STRUCT.size
+                bone_segments[bone_id] = bytes(body[cursor:cursor + size])
+                cursor += size
+            elif operation == _OPERATION_SCALE or operation == _OPERATION_TIMESTAMPS:
+                if original_bone_animations[bone_id] is None:
+                    raise InvalidPatchError(f"apply_patch(...) -> Error: bone {bone_id} is not animated")
+                bone_animation = original_bone_animations[bone_id].copy()
+                if operation == _OPERATION_SCALE:
+                    bone_animation.scale_timestamps_according_to_frame_count(
+                        original_animation.get_frame_count(), target_frame_count
+                    )
+                else:
+                    size = 2 * bone_animation.get_keyframe_count()
+                    bone_animation.set_timestamps(codec.unpack_many("H", body[cursor:cursor + size]))
+                    cursor += size
+                bone_segments[bone_id] = bone_animation.dump()
+            else:
+                raise InvalidPatchError(f"apply_patch(...) -> Error: unknown operation ({operation})")
+        animation = Animation.from_bone_segments(target_magic, target_frame_count, header_rem, bone_segments)
+    except InvalidPatchError:
+        raise
+    except (struct.error, IndexError, ValueError, AnimationError) as e:
+        raise InvalidPatchError(f"apply_patch(...) -> Error: corrupted patch ({type(e).__name__}: {e})")
+
+    if bytes.fromhex(animation.digest()) != target_digest:
+        raise InvalidPatchError("apply_patch(...) -> Error: the result doesn't match the patch checksum")
+    return animation
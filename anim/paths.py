@@ -0,0 +1,61 @@
+"""
+This module finds animation files: it's shared by the batch mode and the library index
+"""
+
+
+import os
+import glob
+
+
+ANIMATION_FILE_EXTENSION = ".unk"
+
+
+def expand_paths(patterns) -> list:
+    """
+    Expand a list of file paths, glob patterns and directories into a list of animation file paths.
+    Directories are walked recursively looking for ANIMATION_FILE_EXTENSION files.
+    :param patterns: File paths, glob patterns (** is supported) or directories
+    :return: the list of file paths (without duplicates, in order)
+    """
+    file_paths = []
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        for match in sorted(matches):
+            if not os.path.isdir(match):
+                file_paths.append(match)
+                continue
+            for dir_path, dir_names, file_names in os.walk(match):
+                dir_names.sort()
+                file_paths += [os.path.join(dir_path, file_name) for file_name in sorted(file_names)
+                               if file_name.lower().endswith(ANIMATION_FILE_EXTENSION)]
+    return list(dict.fromkeys(file_paths))
+
+
+def get_base_dir(pattern: str) -> str:
+    """
+    :param pattern: A file path, glob pattern or directory (see expand_paths(...))
+    :return: the directory that the files found by pattern are under: the directory itself, the part of a glob
+             pattern before the first wildcard, or the directory of a file
+    """
+    if os.path.isdir(pattern):
+        return pattern
+    base_dir = os.path.dirname(pattern)
+    while glob.has_magic(base_dir):
+        base_dir = os.path.dirname(base_dir)
+    return base_dir or os.curdir
+
+
+def expand_relative_paths(patterns) -> dict:
+    """
+    Like expand_paths(...), but each file path is given with its path relative to the pattern it was found from (see
+    get_base_dir(...)), eg. "a/x.unk" for "lib/a/x.unk" found from "lib" or "lib/*/x.unk"
+    :param patterns: File paths, glob patterns (** is supported) or directories
+    :return: file path -> relative path ("/" separated), without duplicates (a file found from many patterns keeps the
+             relative path of the first one), in order
+    """
+    relative_paths = {}
+    for pattern in patterns:
+        base_dir = get_base_dir(pattern)
+        for file_path in expand_paths([pattern]):
+            relative_paths.setdefault(file_path, os.path.relpath(file_path, base_dir).replace(os.sep, "/"))
+    return relative_paths
@@ -0,0 +1,246 @@
+"""
+This module provides a content-addressed store of animations. Many animations share byte-identical bone animations
+(eg. idle tails, unchanged fingers): the store keeps each distinct bone animation binary form (segment) once, keyed by
+its digest (see BoneAnimation.digest()), and each animation as a manifest that references its segments by digest.
+Animations are rebuilt on demand, sharing the stored segments (no copies), and saved as standard animation files.
+A store can live only in memory, or in a directory (segments/ and manifests/ inside it).
+"""
+
+
+import os
+import json
+import hashlib
+from anim.bt3animation import Animation, save_animation
+
+
+_SEGMENTS_DIR_NAME = "segments"
+_MANIFESTS_DIR_NAME = "manifests"
+_MANIFEST_EXTENSION = ".json"
+
+
+class SegmentStore:
+    """
+    Content-addressed store of animations (see the module documentation).
+    Animations are stored under a name: a relative path like "goku/stance.unk" ("/" separated, no "." or ".."
+    components). Manifests are all kept in memory; segments are read from disk when first needed, checked against
+    their digest and then kept in memory, so each distinct segment is held once however many animations use it.
+    """
+
+    def __init__(self, root_dir: str = None):
+        """
+        Constructor. The manifests of an existing store are loaded.
+        :param root_dir: Store directory (created if needed). If None, the store lives only in memory
+        """
+        self._root_dir = root_dir
+        self._segments = {}  # Digest -> segment (bytes)
+        self._manifests = {}  # Name -> manifest (dict)
+
+        if root_dir is None:
+            return
+        os.makedirs(os.path.join(root_dir, _SEGMENTS_DIR_NAME), exist_ok=True)
+        manifests_dir = os.path.join(root_dir, _MANIFESTS_DIR_NAME)
+        os.makedirs(manifests_dir, exist_ok=True)
+        for dir_path, dir_names, file_names in os.walk(manifests_dir):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if not file_name.endswith(_MANIFEST_EXTENSION):
+                    continue
+                manifest_path = os.path.join(dir_path, file_name)
+                name = os.path.relpath(manifest_path, manifests_dir)[:-len(_MANIFEST_EXTENSION)]
+                with open(manifest_path, "r") as file:
+                    self._manifests[name.replace(os.sep, "/")] = json.load(file)
+
+    @staticmethod
+    def _check_name(name: str):
+        """
+        :raise ValueError: if name is not a valid animation name
+        """
+        components = name.split("/")
+        if name == "" or name.startswith("/") or "\\" in name or any(c in ("", ".", "..") for c in components):
+            raise ValueError(f"SegmentStore -> _check_name(...) -> Error: invalid name ({name})")
+
+    def _get_segment_path(self, digest: str) -> str:
+        return os.path.join(self._root_dir, _SEGMENTS_DIR_NAME, digest[:2], digest)
+
+    def _get_manifest_path(self, name: str) -> str:
+        return os.path.join(self._root_dir, _MANIFESTS_DIR_NAME, *name.split("/")) + _MANIFEST_EXTENSION
+
+    @staticmethod
+    def _write_file(file_path: str, data: bytes):
+        """
+        Write a file atomically (a temporary file replaces it)
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temp_file_path = file_path + ".tmp"
+        with open(temp_file_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_file_path, file_path)
+
+    def _put_segment(self, bone_animation) -> int:
+        """
+        Store the segment of a bone animation, if not already stored
+        :return: the number of bytes added to the store
+        """
+        digest = bone_animation.digest()
+        if digest in self._segments:
+            return 0
+        segment = bone_animation.dump()
+        self._segments[digest] = segment
+        if self._root_dir is None:
+            return len(segment)
+        segment_path = self._get_segment_path(digest)
+        if os.path.exists(segment_path):
+            return 0
+        self._write_file(segment_path, segment)
+        return len(segment)
+
+    def _get_segment(self, digest: str) -> bytes:
+        """
+        :return: a stored segment
+        :raise ValueError: if the segment is missing or corrupted
+        """
+        segment = self._segments.get(digest)
+        if segment is not None:
+            return segment
+        if self._root_dir is None:
+            raise ValueError(f"SegmentStore -> _get_segment(...) -> Error: missing segment {digest}")
+        try:
+            with open(self._get_segment_path(digest), "rb") as file:
+                segment = file.read()
+        except FileNotFoundError:
+            raise ValueError(f"SegmentStore -> _get_segment(...) -> Error: missing segment {digest}")
+        if hashlib.sha256(segment).hexdigest() != digest:
+            raise ValueError(f"SegmentStore -> _get_segment(...) -> Error: corrupted segment {digest}")
+        self._segments[digest] = segment
+        return segment
+
+    def put(self, name: str, animation: Animation) -> int:
+        """
+        Store an animation (replacing the one with the same name, if any)
+        :param name: Animation name (see SegmentStore)
+        :param animation: The animation to store (it's not changed)
+        :return: the number of bytes added to the store (segments that were not already stored)
+        :raise ValueError: if name is not valid
+        """
+        self._check_name(name)
+        added_size = 0
+        bone_digests = []
+        for bone_animation in animation.get_bone_animations():
+            if bone_animation is None:
+                bone_digests.append(None)
+                continue
+            bone_digests.append(bone_animation.digest())
+            added_size += self._put_segment(bone_animation)
+
+        manifest = {
+            "magic": animation.get_magic(),
+            "frame_count": animation.get_frame_count(),
+            "header_rem": animation.get_header_rem().hex(),
+            "bones": bone_digests,
+            "digest": animation.digest(),
+        }
+        if self._root_dir is not None:
+            self._write_file(self._get_manifest_path(name), json.dumps(manifest).encode("utf-8"))
+        self._manifests[name] = manifest
+        return added_size
+
+    def get_names(self) -> list:
+        """
+        :return: the names of the stored animations, sorted
+        """
+        return sorted(self._manifests)
+
+    def contains(self, name: str) -> bool:
+        return name in self._manifests
+
+    def get_digest(self, name: str) -> str:
+        """
+        :return: the digest of a stored animation (see Animation.digest())
+        :raise KeyError: if there is no animation with that name
+        """
+        return self._manifests[name]["digest"]
+
+    def get_animation(self, name: str) -> Animation:
+        """
+        Rebuild a stored animation. Its bone animations share the stored segments (no copies), so many rebuilt
+        animations take little more memory than the distinct segments they use.
+        :param name: Animation name
+        :return: the animation
+        :raise KeyError: if there is no animation with that name
+        :raise ValueError: if a segment is missing or corrupted
+        """
+        manifest = self._manifests[name]
+        return Animation.from_bone_segments(
+            manifest["magic"], manifest["frame_count"], bytes.fromhex(manifest["header_rem"]),
+            [None if digest is None else self._get_segment(digest) for digest in manifest["bones"]]
+        )
+
+    def export(self, name: str, file_path: str) -> int:
+        """
+        Rebuild a stored animation and save it as an animation file (see save_animation(...)). The file is checked
+        against the digest of the stored animation.
+        :param name: Animation name
+        :param file_path: Destination file path
+        :return: the number of bytes written
+        :raise KeyError: if there is no animation with that name
+        :raise ValueError: if a segment is missing or corrupted
+        """
+        animation = self.get_animation(name)
+        if animation.digest() != self.get_digest(name):
+            raise ValueError(f"SegmentStore -> export(...) -> Error: {name} doesn't match its digest")
+        return save_animation(animation, file_path)
+
+    def remove(self, name: str):
+        """
+        Remove a stored animation. Its segments are kept (see collect_garbage())
+        :raise KeyError: if there is no animation with that name
+        """
+        del self._manifests[name]
+        if self._root_dir is not None:
+            os.remove(self._get_manifest_path(name))
+
+    def _get_referenced_digests(self) -> set:
+        return {digest for manifest in self._manifests.values() for digest in manifest["bones"] if digest is not None}
+
+    def collect_garbage(self) -> int:
+        """
+        Remove the segments that no stored animation references anymore
+        :return: the number of segments removed
+        """
+        referenced_digests = self._get_referenced_digests()
+        digests = set(self._segments)
+        if self._root_dir is not None:
+            segments_dir = os.path.join(self._root_dir, _SEGMENTS_DIR_NAME)
+            for dir_path, _, file_names in os.walk(segments_dir):
+                digests.update(file_name for file_name in file_names if not file_name.endswith(".tmp"))
+
+        removed_digests = digests - referenced_digests
+        for digest in removed_digests:
+            self._segments.pop(digest, None)
+            if self._root_dir is not None and os.path.exists(self._get_segment_path(digest)):
+                os.remove(self._get_segment_path(digest))
+        return len(removed_digests)
+
+    def get_stats(self) -> dict:
+        """
+        :return: store statistics: number of "animations" and of distinct "segments" they use, "stored_size" (size of
+                 those segments) and "logical_size" (size of all the bone animations, as if each animation had its own
+                 copy of them)
+        """
+        segment_sizes = {}
+        logical_size = 0
+        for manifest in self._manifests.values():
+            for digest in manifest["bones"]:
+                if digest is None:
+                    continue
+                if digest not in segment_sizes:
+                    segment = self._segments.get(digest)
+                    segment_sizes[digest] = len(segment) if segment is not None \
+                        else os.path.getsize(self._get_segment_path(digest))
+                logical_size += segment_sizes[digest]
+        return {
+            "animations": len(self._manifests),
+            "segments": len(segment_sizes),
+            "stored_size": sum(segment_sizes.values()),
+            "logical_size": logical_size,
+        }
@@ -0,0 +1,110 @@
+"""
+This module generates valid synthetic BT3 animations (eg. for benchmarks), with configurable frame count, number of
+animated bones, mix of keyframe types and keyframe density.
+Bones move smoothly: each one rotates around its own axis, and the ones with keyframes type 0 also move along a
+small loop, so the generated animations behave like real ones when they are interpolated or reduced.
+"""
+
+
+import math
+import random
+from myutils import codec
+from anim.bt3animation import Animation
+from anim.interpolation import ROT_STRUCT_SCALE
+
+
+_BONE_COUNT = 56
+_KEYFRAME0_STRUCT = codec.get_struct("3fI4h")  # Translation, timestamp, rot_struct
+
+# Bone animation offsets are stored divided by 4 in 16-bit integers
+_MAX_DUMP_SIZE = 0xFFFF * 4
+
+
+def _get_rotation(axis: tuple, angle: float) -> list:
+    """
+    :return: the rot_struct components of the rotation of angle (radians) around axis
+    """
+    sin_half = math.sin(angle / 2)
+    return [round(c * ROT_STRUCT_SCALE) for c in (axis[0] * sin_half, axis[1] * sin_half, axis[2] * sin_half,
+                                                  math.cos(angle / 2))]
+
+
+def _generate_bone_animation(rng: random.Random, bone_type: int, frame_count: int, keyframe_density: float) -> bytes:
+    """
+    :return: the binary form of a bone animation
+    """
+    # The first and the last frames always have a keyframe
+    timestamps = [frame for frame in range(frame_count + 1)
+                  if frame == 0 or frame == frame_count or rng.random() < keyframe_density]
+
+    axis = [rng.gauss(0, 1) for _ in range(3)]
+    norm = math.sqrt(sum(c * c for c in axis)) or 1.0
+    axis = [c / norm for c in axis]
+    phase = rng.uniform(-math.pi, math.pi)
+    speed = rng.uniform(-0.2, 0.2)
+    rotations = [_get_rotation(axis, phase + speed * timestamp) for timestamp in timestamps]
+
+    header = codec.pack("HH", bone_type, len(timestamps))
+    if bone_type == 1:
+        rot_structs = codec.pack_many("h", [c for rotation in rotations for c in rotation])
+        packed_timestamps = codec.pack_many("H", timestamps)
+        return header + rot_structs + packed_timestamps + bytes(len(packed_timestamps) % 4)
+
+    center = [rng.uniform(-1, 1) for _ in range(3)]
+    radius = rng.uniform(0.01, 0.2)
+    keyframes = bytearray(_KEYFRAME0_STRUCT.size * len(timestamps))
+    for i, (timestamp, rotation) in enumerate(zip(timestamps, rotations)):
+        angle = phase + speed * timestamp
+        _KEYFRAME0_STRUCT.pack_into(
+            keyframes, i * _KEYFRAME0_STRUCT.size,
+            center[0] + radius * math.cos(angle), center[1] + radius * math.sin(angle), center[2], timestamp, *rotation
+        )
+    return header + keyframes
+
+
+def generate_animation_dump(frame_count: int = 40, animated_bone_count: int = _BONE_COUNT, type0_ratio: float = 0.5,
+                            keyframe_density: float = 0.5, magic: int = 0, seed=None) -> bytes:
+    """
+    Generate the binary form of a synthetic animation
+    :param frame_count: Frame count
+    :param animated_bone_count: Number of animated bones (which ones is random)
+    :param type0_ratio: Probability that a bone animation has keyframes type 0 (rotations and translations)
+    :param keyframe_density: Probability that a frame (other than the first and the last) has a keyframe
+    :param magic: "Magic" number of the animation
+    :param seed: Seed of the random generator (the same seed gives the same animation)
+    :return: the binary form of the animation
+    :raise ValueError: if the parameters are out of range, or the animation would be too big for the format
+    """
+    if frame_count < 1 or frame_count > 0xFFFF or not 1 <= animated_bone_count <= _BONE_COUNT:
+        raise ValueError(
+            f"generate_animation_dump(...) -> Error: invalid frame count ({frame_count}) or animated bone count "
+            f"({animated_bone_count})"
+        )
+
+    rng = random.Random(seed)
+    animated_bones = set(rng.sample(range(_BONE_COUNT), animated_bone_count))
+
+    segments = []
+    offsets = []
+    size = codec.get_struct("HH" + "H" * _BONE_COUNT).size
+    for bone_id in range(_BONE_COUNT):
+        if bone_id not in animated_bones:
+            offsets.append(0)
+            continue
+        bone_type = 0 if rng.random() < type0_ratio else 1
+        segments.append(_generate_bone_animation(rng, bone_type, frame_count, keyframe_density))
+        offsets.append(size // 4)
+        size += len(segments[-1])
+
+    if size > _MAX_DUMP_SIZE:
+        raise ValueError(f"generate_animation_dump(...) -> Error: the animation is too big ({size} bytes)")
+
+    header = codec.pack("HH" + "H" * _BONE_COUNT, magic, frame_count, *offsets)
+    return b"".join([header] + segments + [bytes(-size % 16)])
+
+
+def generate_animation(*args, **kwargs) -> Animation:
+    """
+    Generate a synthetic animation (see generate_animation_dump(...) for the parameters)
+    """
+    return Animation(generate_animation_dump(*args, **kwargs))
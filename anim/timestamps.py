@@ -0,0 +1,88 @@
+"""
+This module provides bulk operations on the timestamps of many bone animations at once.
+If NumPy is available, all the timestamps are gathered in a single array (with the offsets of each bone animation
+segment) and every operation is a single vectorized computation. Otherwise (or for few keyframes, where NumPy has no
+advantage) they fall back to pure Python. Both paths give exactly the same results.
+"""
+
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Set to False to always use the pure Python implementation
+USE_NUMPY = numpy is not None
+
+# Minimum number of timestamps for which NumPy is used
+NUMPY_THRESHOLD = 256
+
+_TIMESTAMP_MAX = 0xFFFFFFFF
+
+
+def _use_numpy(timestamp_arrays: list) -> bool:
+    return USE_NUMPY and sum(len(timestamps) for timestamps in timestamp_arrays) >= NUMPY_THRESHOLD
+
+
+def _join(timestamp_arrays: list):
+    """
+    :return: all the timestamps in a single NumPy array (float64) and the offsets of the segments
+    """
+    segment_ends = numpy.cumsum([len(timestamps) for timestamps in timestamp_arrays])
+    joined = numpy.concatenate(
+        [numpy.frombuffer(timestamps, dtype=numpy.uint32) for timestamps in timestamp_arrays]
+    ).astype(numpy.float64)
+    return joined, segment_ends[:-1]
+
+
+def _split(joined, segment_offsets) -> list:
+    """
+    :return: the segments of joined as arrays of uint32 ("I")
+    """
+    if len(joined) > 0 and (joined.min() < 0 or joined.max() > _TIMESTAMP_MAX):
+        raise OverflowError("timestamps -> _split(...) -> Error: timestamp out of range")
+    joined = joined.astype(numpy.uint32)
+    timestamp_arrays = []
+    for segment in numpy.split(joined, segment_offsets):
+        timestamps = array("I")
+        timestamps.frombytes(segment.tobytes())
+        timestamp_arrays.append(timestamps)
+    return timestamp_arrays
+
+
+def scale_timestamps(timestamp_arrays: list, old_frame_count: int, new_frame_count: int) -> list:
+    """
+    Scale the timestamps according to a change of frame count, rounding them to the nearest integer (see
+    BoneAnimation.scale_timestamps_according_to_frame_count(...))
+    :param timestamp_arrays: Timestamps of the bone animations (list of arrays of "I")
+    :param old_frame_count: Old frame count
+    :param new_frame_count: New frame count
+    :return: the scaled timestamps (new arrays, in the same order)
+    """
+    if not _use_numpy(timestamp_arrays):
+        return [array("I", [round(timestamp / old_frame_count * new_frame_count) for timestamp in timestamps])
+                for timestamps in timestamp_arrays]
+
+    # numpy.rint rounds half to even, like round(...)
+    joined, segment_offsets = _join(timestamp_arrays)
+    return _split(numpy.rint(joined / old_frame_count * new_frame_count), segment_offsets)
+
+
+def offset_timestamps(timestamp_arrays: list, offset) -> list:
+    """
+    Add an offset to all the timestamps
+    :param timestamp_arrays: Timestamps of the bone animations (list of arrays of "I")
+    :param offset: Timestamp offset (int), or a list with an offset for each array
+    :return: the new timestamps (new arrays, in the same order)
+    """
+    offsets = [offset] * len(timestamp_arrays) if isinstance(offset, int) else offset
+
+    if not _use_numpy(timestamp_arrays):
+        return [array("I", [timestamp + offset for timestamp in timestamps])
+                for timestamps, offset in zip(timestamp_arrays, offsets)]
+
+    joined, segment_offsets = _join(timestamp_arrays)
+    return _split(joined + numpy.repeat(offsets, [len(timestamps) for timestamps in timestamp_arrays]), segment_offsets)
@@ -0,0 +1,174 @@
+"""
+BT3 Animation Worker benchmarks.
+Measure the throughput (files/s, MB/s, keyframes/s) and the peak memory of the main operations on synthetic animations
+(see anim.synthetic), and compare them with a previous run. Everything runs in memory: no file is needed.
+"""
+
+
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from anim.bt3animation import Animation, make_bone_mask
+from anim.synthetic import generate_animation_dump
+
+
+WORKLOADS = ("parse", "decode", "dump", "scale", "concat", "mix")
+
+# Bones imported by the "mix" workload
+MIX_BONES = (3, 4, 10, 21, 30, 41, 50, 55)
+
+
+def __prepare_workload(workload: str, dumps: list, donor_dumps: list):
+    """
+    Prepare the inputs of a workload (not measured)
+    :return: a function that runs the workload once
+    """
+    # Parsing reads only the headers and the offset tables: keyframes are decoded when they are first needed
+    if workload == "parse":
+        return lambda: [Animation(dump) for dump in dumps]
+
+    animations = [Animation(dump) for dump in dumps]
+    if workload == "decode":
+        # Accessing a keyframe decodes all the keyframes of its bone animation
+        bone_animations = [bone_animation for animation in animations for bone_animation in
+                           animation.get_bone_animations()
+                           if bone_animation is not None and bone_animation.get_keyframe_count() > 0]
+        return lambda: [bone_animation.get_keyframe(0) for bone_animation in bone_animations]
+
+    if workload == "dump":
+        # Every bone animation has to be encoded again
+        for animation in animations:
+            animation.scale_frame_count(animation.get_frame_count() + 1)
+        return lambda: [animation.dump() for animation in animations]
+
+    if workload == "scale":
+        return lambda: [animation.scale_frame_count(animation.get_frame_count() * 2) for animation in animations]
+
+    if workload == "concat":
+        sources = [Animation(dump) for dump in dumps]
+        return lambda: [animation.concat(source) for animation, source in zip(animations, sources)]
+
+    if workload == "mix":
+        # The donors have a different frame count, so the imported bone animations are scaled too
+        donors = [Animation(dump) for dump in donor_dumps]
+        bone_mask = make_bone_mask(MIX_BONES)
+        return lambda: [animation.import_bone_animations(donor, bone_mask)
+                        for animation, donor in zip(animations, donors)]
+
+    raise ValueError(f"__prepare_workload(...) -> Error: unknown workload ({workload})")
+
+
+def __run_workload(workload: str, dumps: list, donor_dumps: list, repeat: int) -> dict:
+    """
+    Run a workload (the best of repeat runs is taken) and measure its peak memory (in a separate run, since tracing
+    memory allocations slows everything down)
+    :return: the results of the workload
+    """
+    best_time = None
+    for _ in range(repeat):
+        run = __prepare_workload(workload, dumps, donor_dumps)
+        start_time = time.perf_counter()
+        run()
+        elapsed_time = time.perf_counter() - start_time
+        best_time = elapsed_time if best_time is None else min(best_time, elapsed_time)
+
+    run = __prepare_workload(workload, dumps, donor_dumps)
+    tracemalloc.start()
+    run()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    size = sum(len(dump) for dump in dumps)
+    keyframe_count = sum(Animation(dump).get_keyframe_count() for dump in dumps)
+    best_time = max(best_time, 1e-9)
+    return {
+        "seconds": best_time,
+        "files_per_second": len(dumps) / best_time,
+        "megabytes_per_second": size / best_time / 1e6,
+        # Parsing doesn't touch the keyframes
+        "keyframes_per_second": keyframe_count / best_time if workload != "parse" else None,
+        "peak_memory": peak_memory,
+    }
+
+
+def __build_arg_parser() -> argparse.ArgumentParser:
+    """
+    Build the parser of the command line arguments
+    """
+    parser = argparse.ArgumentParser(description="BT3 Animation Worker benchmarks (on synthetic animations)")
+    parser.add_argument("workloads", nargs="*", help=f"what to measure (default: all of {', '.join(WORKLOADS)})")
+    parser.add_argument("--files", type=int, default=200, help="number of animations (default: 200)")
+    parser.add_argument("--frames", type=int, default=60, help="frame count of the animations (default: 60)")
+    parser.add_argument("--bones", type=int, default=40, help="animated bones of each animation (default: 40)")
+    parser.add_argument("--type0-ratio", type=float, default=0.5,
+                        help="fraction of bone animations with translations (keyframes type 0, default: 0.5)")
+    parser.add_argument("--density", type=float, default=0.5,
+                        help="probability that a frame has a keyframe (default: 0.5)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic animations (default: 0)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each workload, the best is taken (default: 5)")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+    parser.add_argument("--save", default=None, help="where to save the results (JSON)")
+    return parser
+
+
+def main(argv: list = None) -> int:
+    parser = __build_arg_parser()
+    args = parser.parse_args(argv)
+    args.workloads = args.workloads or list(WORKLOADS)
+    for workload in args.workloads:
+        if workload not in WORKLOADS:
+            parser.error(f"unknown workload {workload} (choose from {', '.join(WORKLOADS)})")
+
+    config = {
+        "files": args.files,
+        "frames": args.frames,
+        "bones": args.bones,
+        "type0_ratio": args.type0_ratio,
+        "density": args.density,
+        "seed": args.seed,
+        "python": platform.python_version(),
+    }
+    dumps = [generate_animation_dump(args.frames, args.bones, args.type0_ratio, args.density, seed=args.seed + i)
+             for i in range(args.files)]
+    donor_dumps = [generate_animation_dump(args.frames + 10, args.bones, args.type0_ratio, args.density,
+                                           seed=args.seed + args.files + i)
+                   for i in range(args.files)]
+    print(f"{args.files} synthetic animations, {sum(len(dump) for dump in dumps) / 1e6:.2f} MB, "
+          f"{sum(Animation(dump).get_keyframe_count() for dump in dumps)} keyframes")
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        if baseline.get("config") != config:
+            print("Warning: the baseline was measured with a different configuration")
+
+    print(f"{'workload':<10}{'files/s':>12}{'MB/s':>10}{'keyframes/s':>14}{'peak KiB':>11}  vs baseline")
+    results = {}
+    for workload in args.workloads:
+        result = __run_workload(workload, dumps, donor_dumps, args.repeat)
+        results[workload] = result
+
+        comparison = ""
+        if baseline is not None and workload in baseline.get("results", {}):
+            baseline_result = baseline["results"][workload]
+            speedup = result["files_per_second"] / baseline_result["files_per_second"]
+            memory_change = result["peak_memory"] / max(baseline_result["peak_memory"], 1)
+            comparison = f"{speedup:.2f}x speed, {memory_change:.2f}x memory"
+        keyframes_per_second = result["keyframes_per_second"]
+        keyframes_per_second = f"{keyframes_per_second:.0f}" if keyframes_per_second is not None else "-"
+        print(f"{workload:<10}{result['files_per_second']:>12.1f}{result['megabytes_per_second']:>10.2f}"
+              f"{keyframes_per_second:>14}{result['peak_memory'] / 1024:>11.1f}  {comparison}")
+
+    if args.save is not None:
+        with open(args.save, "w") as file:
+            json.dump({"config": config, "results": results}, file, indent=2)
+        print(f"Results saved on {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,8 +3,19 @@ BT3 Animation Worker main script
 """
 
 
+import os
 import sys
-from anim.bt3animation import Animation, UnconcatenableAnimationsError
+import math
+import cProfile
+import argparse
+import multiprocessing
+from anim.bt3animation import Animation, AnimationError, InvalidAnimationError, save_animation, load_animation
+from anim import batch, instrumentation
+from anim.paths import expand_paths, expand_relative_paths
+from anim.cache import AnimationCache
+from anim.library import LibraryIndex
+from anim.store import SegmentStore
+from anim.history import EditHistory
 
 
 LOGO = """
@@ -20,12 +31,22 @@ CMDS = (
     {"key": "1", "info": "Change animation speed", "name": "change_speed"},
     {"key": "2", "info": "Join current animation with another (one after the other)", "name": "concat"},
     {"key": "3", "info": "Mix current animation with another (import single bone animations)", "name": "mix"},
+    {"key": "4", "info": "Reduce keyframes (drop the ones that can be interpolated)", "name": "reduce"},
+    {"key": "U", "info": "Undo the last change", "name": "undo"},
+    {"key": "R", "info": "Redo the last undone change", "name": "redo"},
+    {"key": "O", "info": "Go back to the original animation (it can be undone)", "name": "revert"},
+    {"key": "H", "info": "Print the edit history", "name": "print_history"},
     {"key": "S", "info": "Save current animation", "name": "save"},
     {"key": "Q", "info": "Quit", "name": "quit"}
 )
 
+# Label of the speed changes in the edit history
+SPEED_CHANGE_LABEL = "change speed"
+
 animation: Animation = None
 animation_file_path: str = None
+history: EditHistory = None
+animation_cache = AnimationCache()
 
 
 def __ask_user_command():
@@ -48,7 +69,7 @@ def __load_animation(file_path: str):
     Load an animation from disk
     :param file_path: Animation file path
     """
-    global animation, animation_file_path
+    global animation, animation_file_path, history
     try:
         with open(file_path, "rb") as file:
             dump = file.read()
@@ -58,8 +79,117 @@ def __load_animation(file_path: str):
     if dump is None or len(dump) <= 0:
         print("Error opening animation. Wrong file path?")
         return
+    try:
+        new_animation = Animation(dump)
+    except InvalidAnimationError as e:
+        print(f"Error opening animation -> {str(e)}")
+        return
     animation_file_path = file_path
-    animation = Animation(dump)
+    animation = new_animation
+    history = EditHistory(new_animation)
+
+
+def __discard_change():
+    """
+    Go back to the current version of the edit history, dropping the changes made to the animation since then
+    """
+    global animation
+    animation = history.get_animation()
+
+
+def __commit_change(label: str) -> bool:
+    """
+    Record the current animation in the edit history, after a change. If the animation can't be recorded (eg. no bone
+    is animated anymore), the change is discarded
+    :param label: Description of the change
+    :return: whether the change has been recorded
+    """
+    try:
+        history.commit(animation, label)
+    except AnimationError as e:
+        print(f"Unable to perform the operation -> {str(e)}")
+        __discard_change()
+        return False
+    return True
+
+
+def __undo():
+    """
+    Go back to the previous version of the animation
+    """
+    global animation
+    if animation is None:
+        print("No animation loaded")
+        return
+    label = history.undo()
+    if label is None:
+        print("Nothing to undo")
+        return
+    animation = history.get_animation()
+    print(f"Undone: {label}")
+
+
+def __redo():
+    """
+    Go forward to the next version of the animation (undone before)
+    """
+    global animation
+    if animation is None:
+        print("No animation loaded")
+        return
+    label = history.redo()
+    if label is None:
+        print("Nothing to redo")
+        return
+    animation = history.get_animation()
+    print(f"Redone: {label}")
+
+
+def __revert_animation():
+    """
+    Go back to the original animation (as loaded from disk), without reading it again
+    """
+    global animation
+    if animation is None:
+        print("No animation loaded")
+        return
+    history.revert()
+    animation = history.get_animation()
+    print("Back to the original animation (undo to get the changes back)")
+
+
+def __print_history():
+    """
+    Print the edit history
+    """
+    if animation is None:
+        print("No animation loaded")
+        return
+    for i, label in enumerate(history.get_labels()):
+        print(f"{'>' if i == history.get_position() else ' '} {i}. {label}")
+    stats = history.get_stats()
+    print(f"{stats['versions']} versions, {stats['memory_usage']} bytes of bone animations kept for "
+          f"{stats['unshared_size']} bytes of versions")
+
+
+def __parse_bone_list(text: str) -> list:
+    """
+    Parse a list of bone IDs (in decimal or hexadecimal form), eg. "3,4,0x15"
+    """
+    return [int(x, 0) for x in text.replace(" ", "").replace("\t", "").replace(";", ",").split(",")]
+
+
+def __parse_worker_count(text: str) -> int:
+    """
+    Parse the number of worker processes of the batch mode (at least 1)
+    """
+    try:
+        workers = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number of worker processes ({text})")
+    if workers < 1:
+        raise argparse.ArgumentTypeError(f"there must be at least 1 worker process ({workers})")
+    return workers
 
 
 def __ask_and_load_animation():
@@ -83,26 +213,27 @@ def __print_animation_info():
     print(f"  Magic number: {animation.get_magic()}")
     print(f"  Frame count: {animation.get_frame_count()}")
     print(f"  Animated bones: {animation.get_animated_bone_count()}")
-    print(f"  Size: {len(animation.dump())}")
+    print(f"  Keyframes: {animation.get_keyframe_count()}")
+    print(f"  Size: {animation.get_dump_size()}")
 
 
 def __save_animation():
     """
     Save the animation on disk.
-    The file path derives from the original (just add "_save" before ".unk").
+    By default, the file path derives from the original (just add "_save" before ".unk").
     Does not change animation_file_path.
     """
     if animation is None or animation_file_path is None:
         print("No animation loaded")
         return
-    out_file_path = animation_file_path
-    if out_file_path.endswith(".unk"):
-        out_file_path = out_file_path[:-4] + "_save.unk"
-    else:
-        out_file_path = out_file_path + "_save.unk"
+    out_file_path = batch.get_save_file_path(animation_file_path)
+    out_file_path = input(f"File path (empty for {out_file_path}): ").replace("\"", "") or out_file_path
     print(f"Saving on {out_file_path} ...")
-    with open(out_file_path, "wb") as file:
-        file.write(animation.dump())
+    try:
+        save_animation(animation, out_file_path)
+    except OSError as e:
+        print(f"Unable to save the animation -> {str(e)}")
+        return
     print("Done! :D")
 
 
@@ -110,6 +241,7 @@ def __change_animation_speed():
     """
     Ask the user for the new frame count and scale the animation to that frame count
     """
+    global animation
     if animation is None:
         print("No animation loaded")
         return
@@ -117,9 +249,9 @@ def __change_animation_speed():
     print(
         "It's possible to change the animation speed by changing it's frame count. Less frames means a faster"
         "animation.\n"
-        "When scaling an animation to a new frame count it looses precision. If you changes it a couple of times it's "
-        "not a big deal, but the best approach is to store the original animation somewhere and, if you want to change "
-        "the frame count again, do it with the original animation"
+        "When scaling an animation to a new frame count it looses precision. Changing it again right after starts "
+        "from the animation before the previous change, so precision is not lost twice (and [O] goes back to the "
+        "original animation at any time)"
     )
     print(f"Current frame count is {animation.get_frame_count()}")
     try:
@@ -132,43 +264,103 @@ def __change_animation_speed():
     if animation.get_frame_count() == new_frame_count:
         print(f"The animation already has a frame count of {new_frame_count}")
         return
+    interpolate = input("Interpolate keyframes instead of just moving them? [y/N] ").strip().upper() == "Y"
+
+    # Scale again the animation before the previous speed change, instead of scaling the already scaled one. The
+    # previous speed change is undone only once the new one has been computed
+    last_label = history.get_last_label()
+    replace_last_change = last_label is not None and last_label.startswith(SPEED_CHANGE_LABEL)
+    position = history.get_position() - 1 if replace_last_change else history.get_position()
+    scaled_animation = history.get_animation(position)
+
+    # Interpolation avoids keyframes landing on the same frame, at the cost of computing new rotations
+    try:
+        if interpolate:
+            scaled_animation.resample_frame_count(new_frame_count)
+        else:
+            scaled_animation.scale_frame_count(new_frame_count)
+    except (AnimationError, ValueError, OverflowError) as e:
+        print(f"Unable to perform the operation -> {str(e)}")
+        return
 
-    animation.scale_frame_count(new_frame_count)
+    if replace_last_change:
+        history.undo()
+    animation = scaled_animation
+    label = f"{SPEED_CHANGE_LABEL} to {new_frame_count} frames{' (interpolated)' if interpolate else ''}"
+    if not __commit_change(label):
+        if replace_last_change:
+            history.redo()
+            __discard_change()
+        return
 
     print(f"Animation scaled to {new_frame_count} frames")
 
 
-def __mix_animations():
+def __reduce_keyframes():
     """
-    Ask the user for the file path of a second animation to import from them some bone animations
+    Ask the user for the tolerances and drop the keyframes that can be interpolated from their neighbours
     """
     if animation is None:
         print("No animation loaded")
         return
 
-    # Load the second animation
-    file_path = input("File path of the animation from which extract bone animations: ")
-    file_path = file_path.replace("\"", "")
+    print(
+        "Keyframes that can be computed from the ones around them are dropped. With tolerances 0 only exact matches "
+        "are dropped (the animation doesn't change at all)."
+    )
     try:
-        with open(file_path, "rb") as file:
-            dump = file.read()
+        angular_tolerance = float(input("Rotation tolerance in degrees (empty for 0): ") or 0)
+        positional_tolerance = float(input("Translation tolerance (empty for 0): ") or 0)
+    except ValueError as e:
+        print(f"Error reading the tolerance! Aborting operation\n Exception was {str(e)}")
+        return
+
+    old_keyframe_count = animation.get_keyframe_count()
+    saved = animation.reduce_keyframes(math.radians(angular_tolerance), positional_tolerance)
+    if not __commit_change(f"reduce keyframes ({angular_tolerance} degrees, {positional_tolerance})"):
+        return
+    print(f"{old_keyframe_count - animation.get_keyframe_count()} keyframes dropped, {saved} bytes saved")
+
+
+def __ask_and_load_second_animation(prompt: str) -> tuple:
+    """
+    Ask for a file path and load an animation (other than the current one) from disk. Animations are cached, so that
+    using the same one many times doesn't read and parse it again.
+    :param prompt: What to ask
+    :return: the file path and the animation (None if it was not possible to load it)
+    """
+    file_path = input(prompt).replace("\"", "")
+    try:
+        return file_path, animation_cache.get(file_path)
     except FileNotFoundError:
         print("File not found. Abort operation.")
+    except InvalidAnimationError as e:
+        print(f"Error opening animation -> {str(e)}")
+    return file_path, None
+
+
+def __mix_animations():
+    """
+    Ask the user for the file path of a second animation to import from them some bone animations
+    """
+    if animation is None:
+        print("No animation loaded")
         return
-    if dump is None or len(dump) <= 0:
-        print("Error opening animation. Wrong file path?")
+
+    # Load the second animation
+    file_path, second_animation = __ask_and_load_second_animation(
+        "File path of the animation from which extract bone animations: "
+    )
+    if second_animation is None:
         return
-    second_animation = Animation(dump)
 
-    # Animations must have the same frame count. Check it!
-    # If the frame counts are different, the second animation has to be "scaled".
+    # If the frame counts are different, the imported bone animations have to be "scaled"
     if animation.get_frame_count() != second_animation.get_frame_count():
         print(
             f"This animation has not the same frame count of the one loaded!\n"
             f"It is {second_animation.get_frame_count()} instead of {animation.get_frame_count()}\n"
-            f"This second animation will be scaled to the correct number of frames"
+            f"The imported bone animations will be scaled to the correct number of frames"
         )
-        second_animation.scale_frame_count(animation.get_frame_count())
 
     # Which bone animations?
     print(
@@ -178,13 +370,20 @@ def __mix_animations():
         "  0x03,0x04,0x15,0x0a to import the same bone animations (but using hexadecimal form)"
     )
     try:
-        bone_list = [int(x, 0) for x in input("> ").replace(" ", "").replace("\t", "").replace(";", ",").split(",")]
+        bone_list = __parse_bone_list(input("> "))
     except ValueError as e:
         print(f"Error processing bone list: {str(e)}")
         return
 
     # Import the bone animations
-    animation.import_bone_animations(source_animation=second_animation, bone_list=bone_list)
+    try:
+        animation.import_bone_animations(source_animation=second_animation, bone_list=bone_list)
+    except AnimationError as e:
+        print(f"Unable to perform the operation -> {str(e)}")
+        __discard_change()
+        return
+    if not __commit_change(f"import bones {bone_list} from {file_path}"):
+        return
     print("Done! :D")
 
 
@@ -197,23 +396,24 @@ def __concat_animation():
         return
 
     # Load the second animation
-    file_path = input("File path of the animation to join: ")
-    file_path = file_path.replace("\"", "")
-    try:
-        with open(file_path, "rb") as file:
-            dump = file.read()
-    except FileNotFoundError:
-        print("File not found. Abort operation.")
+    file_path, second_animation = __ask_and_load_second_animation("File path of the animation to join: ")
+    if second_animation is None:
         return
-    if dump is None or len(dump) <= 0:
-        print("Error opening animation. Wrong file path?")
+
+    # A crossfade hides the snap between the last pose of the first animation and the first pose of the second one
+    try:
+        blend_frames = int(input("Crossfade length in frames (empty for none): ") or 0)
+    except ValueError as e:
+        print(f"Error reading the crossfade length! Aborting operation\n Exception was {str(e)}")
         return
-    second_animation = Animation(dump)
 
     try:
-        dropped = animation.concat(second_animation)
-    except UnconcatenableAnimationsError as e:
+        dropped = animation.concat(second_animation, blend_frames)
+    except AnimationError as e:
         print(f"Unable to perform the operation -> {str(e)}")
+        __discard_change()
+        return
+    if not __commit_change(f"join {file_path}{f' ({blend_frames} frames crossfade)' if blend_frames > 0 else ''}"):
         return
 
     print("Done! :D")
@@ -222,10 +422,370 @@ def __concat_animation():
         print(dropped)
 
 
+def __build_arg_parser() -> argparse.ArgumentParser:
+    """
+    Build the parser of the command line arguments of the batch (non-interactive) mode
+    """
+    parser = argparse.ArgumentParser(
+        description="BT3 Animation Worker, batch mode. Without a command, the interactive mode is started "
+                    "(an animation file path can be given to load it).",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # Options shared by all the commands
+    instrumentation_parser = argparse.ArgumentParser(add_help=False)
+    instrumentation_parser.add_argument("--stats", default=None, metavar="FILE",
+                                        help="record the time spent in each stage, keyframe and byte counts and the "
+                                             "slowest bone animations, and save them on FILE (JSON)")
+    instrumentation_parser.add_argument("--profile", default=None, metavar="FILE",
+                                        help="run under cProfile and save the statistics on FILE (for pstats, implies "
+                                             "-w 1)")
+
+    # Options shared by the commands that process animations
+    common_parser = argparse.ArgumentParser(add_help=False, parents=[instrumentation_parser])
+    common_parser.add_argument("-w", "--workers", type=__parse_worker_count, default=None,
+                               help="number of worker processes (default: one for each CPU)")
+
+    def add_output_dir_argument(subparser):
+        subparser.add_argument("-o", "--output-dir", default=None,
+                               help="where to save the edited animations, with their paths relative to the directory "
+                                    "(or the non-wildcard part of the pattern) they were found from (default: next to "
+                                    "the originals). \"_save\" is added to the file names")
+
+    info_parser = subparsers.add_parser(
+        "info", parents=[common_parser], help="print information about animations (only headers are read)"
+    )
+    info_parser.add_argument("paths", nargs="+", help="animation files, glob patterns or directories")
+
+    validate_parser = subparsers.add_parser(
+        "validate", parents=[common_parser], help="check the structure of animations"
+    )
+    validate_parser.add_argument("paths", nargs="+", help="animation files, glob patterns or directories")
+
+    scale_parser = subparsers.add_parser("scale", parents=[common_parser], help="change the speed of animations")
+    scale_parser.add_argument("--frames", type=int, required=True, help="new frame count")
+    scale_parser.add_argument("--interpolate", action="store_true",
+                              help="resample the keyframes (slerp/lerp) instead of just moving them, so that none of "
+                                   "them is duplicated")
+    scale_parser.add_argument("paths", nargs="+", help="animation files, glob patterns or directories")
+    add_output_dir_argument(scale_parser)
+
+    reduce_parser = subparsers.add_parser(
+        "reduce", parents=[common_parser], help="drop the keyframes that can be interpolated from their neighbours"
+    )
+    reduce_parser.add_argument("--angle", type=float, default=0.0,
+                               help="rotation tolerance in degrees (default: 0, only exact matches)")
+    reduce_parser.add_argument("--distance", type=float, default=0.0,
+                               help="translation tolerance (default: 0, only exact matches)")
+    reduce_parser.add_argument("paths", nargs="+", help="animation files, glob patterns or directories")
+    add_output_dir_argument(reduce_parser)
+
+    slice_parser = subparsers.add_parser("slice", parents=[common_parser], help="extract a part of animations")
+    slice_parser.add_argument("--start", type=int, required=True, help="first frame")
+    slice_parser.add_argument("--end", type=int, required=True, help="last frame (included)")
+    slice_parser.add_argument("paths", nargs="+", help="animation files, glob patterns or directories")
+    add_output_dir_argument(slice_parser)
+
+    concat_parser = subparsers.add_parser(
+        "concat", parents=[common_parser], help="join each animation with another one (one after the other)"
+    )
+    concat_parser.add_argument("--blend", type=int, default=0,
+                               help="crossfade length in frames (default: 0, no crossfade)")
+    concat_parser.add_argument("paths", nargs="+", help="animation files, glob patterns or directories")
+    concat_parser.add_argument("second", help="the animation to append to each of them")
+    add_output_dir_argument(concat_parser)
+
+    chain_parser = subparsers.add_parser(
+        "chain", parents=[common_parser], help="join many animations into a single one (one after the other)"
+    )
+    chain_parser.add_argument("--blend", type=int, default=0,
+                              help="crossfade length in frames (default: 0, no crossfade)")
+    chain_parser.add_argument("paths", nargs="+", help="the animations to join, in order")
+    chain_parser.add_argument("-o", "--output", required=True, help="where to save the result")
+
+    mix_parser = subparsers.add_parser(
+        "mix", parents=[common_parser], help="import single bone animations from an animation into others"
+    )
+    mix_parser.add_argument("--bones", type=__parse_bone_list, required=True,
+                            help="bone IDs (in decimal or hexadecimal form), eg. 3,4,0x15")
+    mix_parser.add_argument("source", help="the animation from which the bone animations are extracted")
+    mix_parser.add_argument("paths", nargs="+", help="animation files, glob patterns or directories")
+    add_output_dir_argument(mix_parser)
+
+    def add_library_arguments(subparser):
+        subparser.add_argument("library", help="root directory of the animation library")
+        subparser.add_argument("--index", default=None,
+                               help="index file path (default: .bt3index inside the library directory)")
+
+    index_parser = subparsers.add_parser(
+        "index", parents=[instrumentation_parser],
+        help="build or update the index of an animation library (only files added or changed since the last update "
+             "are read)"
+    )
+    add_library_arguments(index_parser)
+
+    query_parser = subparsers.add_parser(
+        "query", parents=[instrumentation_parser],
+        help="list the animations of an indexed library that match all the given conditions"
+    )
+    add_library_arguments(query_parser)
+    query_parser.add_argument("--bones", type=__parse_bone_list, default=None,
+                              help="bones that must be animated (in decimal or hexadecimal form), eg. 3,4,0x15")
+    query_parser.add_argument("--type", type=int, choices=(0, 1), default=None,
+                              help="keyframe type of the bone animations of --bones (requires --bones)")
+    query_parser.add_argument("--frames", type=int, default=None, help="frame count")
+    query_parser.add_argument("--magic", type=lambda text: int(text, 0), default=None,
+                              help="\"magic\" number (in decimal or hexadecimal form)")
+    query_parser.add_argument("--update", action="store_true",
+                              help="update the index before the query (default: use it as it is)")
+
+    diff_parser = subparsers.add_parser(
+        "diff", parents=[common_parser],
+        help="compute the patches from animations to their edited versions (the files with the same paths, relative to "
+             "the directory or the non-wildcard part of the pattern they were found from, in another directory)"
+    )
+    diff_parser.add_argument("--edited", required=True, help="directory of the edited animations")
+    diff_parser.add_argument("paths", nargs="+", help="original animation files, glob patterns or directories")
+    diff_parser.add_argument("-o", "--output-dir", required=True,
+                             help="where to save the patches (with the same relative paths of the animations, "
+                                  "\".bt3patch\" added)")
+
+    patch_parser = subparsers.add_parser(
+        "patch", parents=[common_parser], help="apply patches (see diff) to the animations they were computed from"
+    )
+    patch_parser.add_argument("--patches", required=True, help="directory of the patches")
+    patch_parser.add_argument("paths", nargs="+", help="original animation files, glob patterns or directories")
+    add_output_dir_argument(patch_parser)
+
+    archive_parser = subparsers.add_parser(
+        "archive", parents=[instrumentation_parser],
+        help="add animations to a deduplicating store (each distinct bone animation is kept once), named after their "
+             "paths relative to the directory (or the non-wildcard part of the pattern) they were found from"
+    )
+    archive_parser.add_argument("store", help="store directory (created if needed)")
+    archive_parser.add_argument("paths", nargs="+", help="animation files, glob patterns or directories")
+    archive_parser.add_argument("--replace", action="store_true",
+                                help="replace the animations already in the store with the same names (default: "
+                                     "report them as errors)")
+
+    extract_parser = subparsers.add_parser(
+        "extract", parents=[instrumentation_parser], help="rebuild animation files from a deduplicating store"
+    )
+    extract_parser.add_argument("store", help="store directory")
+    extract_parser.add_argument("names", nargs="*", help="names of the animations to rebuild (default: all of them)")
+    extract_parser.add_argument("-o", "--output-dir", required=True, help="where to save the rebuilt animations")
+
+    return parser
+
+
+def __run_batch(argv: list) -> int:
+    """
+    Run a batch (non-interactive) command
+    :param argv: Command line arguments (without the script name)
+    :return: the exit code
+    """
+    args = __build_arg_parser().parse_args(argv)
+
+    if args.stats is not None:
+        instrumentation.enable()
+    if args.profile is None:
+        exit_code = __run_batch_command(args)
+    else:
+        # Other processes wouldn't be profiled
+        args.workers = 1
+        profiler = cProfile.Profile()
+        exit_code = profiler.runcall(__run_batch_command, args)
+        profiler.dump_stats(args.profile)
+        print(f"Profile saved on {args.profile}")
+
+    if args.stats is not None:
+        instrumentation.export_summary(args.stats)
+        print(f"Statistics saved on {args.stats}")
+    return exit_code
+
+
+def __run_batch_command(args: argparse.Namespace) -> int:
+    """
+    Run the jobs of a batch command
+    :param args: Parsed command line arguments
+    :return: the exit code
+    """
+    if args.command == "index" or args.command == "query":
+        return __run_library_command(args)
+    if args.command == "archive" or args.command == "extract":
+        return __run_store_command(args)
+
+    # A chain is a single job: the first animation is the one the others are joined to. The same animation can be
+    # joined many times, so only the files found from a single argument are deduplicated
+    if args.command == "chain":
+        file_paths = [file_path for pattern in args.paths for file_path in expand_paths([pattern])]
+        if len(file_paths) <= 0:
+            print("No animation found")
+            return 1
+        errors = batch.run_jobs(batch.chain_job, file_paths[:1], (file_paths[1:], args.output, args.blend),
+                                workers=1)
+        return 1 if len(errors) > 0 else 0
+
+    relative_paths = expand_relative_paths(args.paths)
+    file_paths = list(relative_paths)
+    if len(file_paths) <= 0:
+        print("No animation found")
+        return 1
+
+    output_dir = getattr(args, "output_dir", None)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if args.command == "info":
+        job, job_args = batch.info_job, ()
+    elif args.command == "validate":
+        job, job_args = batch.validate_job, ()
+    elif args.command == "scale":
+        job, job_args = batch.scale_job, (args.frames, output_dir, args.interpolate)
+    elif args.command == "reduce":
+        job, job_args = batch.reduce_job, (math.radians(args.angle), args.distance, output_dir)
+    elif args.command == "slice":
+        job, job_args = batch.slice_job, (args.start, args.end, output_dir)
+    elif args.command == "concat":
+        job, job_args = batch.concat_job, (args.second, output_dir, args.blend)
+    elif args.command == "diff":
+        job, job_args = batch.diff_job, (args.edited, output_dir)
+    elif args.command == "patch":
+        job, job_args = batch.patch_job, (args.patches, output_dir)
+    else:
+        job, job_args = batch.mix_job, (args.source, args.bones, output_dir)
+
+    # Directory trees are kept inside the output directory, but two files must not be saved on the same path
+    if args.command != "info" and args.command != "validate":
+        saving_file_paths = {}
+        for file_path in file_paths:
+            if args.command == "diff":
+                out_file_path = batch.get_patch_file_path(file_path, output_dir, relative_paths[file_path])
+            else:
+                out_file_path = batch.get_save_file_path(file_path, output_dir, relative_paths[file_path])
+            other_file_path = saving_file_paths.setdefault(os.path.normcase(os.path.abspath(out_file_path)), file_path)
+            if other_file_path != file_path:
+                print(f"{other_file_path} and {file_path} would both be saved on {out_file_path}. Abort operation.")
+                return 1
+    else:
+        relative_paths = None
+
+    errors = batch.run_jobs(job, file_paths, job_args, workers=args.workers, relative_paths=relative_paths)
+
+    print(f"Done! {len(file_paths) - len(errors)} animations processed, {len(errors)} errors")
+    for file_path, error in errors:
+        print(f"  {file_path}: {error}")
+    return 1 if len(errors) > 0 else 0
+
+
+def __update_library_index(index: LibraryIndex) -> bool:
+    """
+    Update and save a library index, printing what changed
+    :return: True if no error occurred
+    """
+    stats = index.update()
+    index.save()
+    print(f"{index.get_entry_count()} animations indexed ({stats['added']} added, {stats['updated']} updated, "
+          f"{stats['removed']} removed, {stats['unchanged']} unchanged), {len(stats['errors'])} errors")
+    for file_path, error in stats["errors"]:
+        print(f"  {file_path}: {error}")
+    return len(stats["errors"]) <= 0
+
+
+def __run_library_command(args: argparse.Namespace) -> int:
+    """
+    Run the index or query command
+    :param args: Parsed command line arguments
+    :return: the exit code
+    """
+    if not os.path.isdir(args.library):
+        print(f"{args.library} is not a directory")
+        return 1
+    index = LibraryIndex(args.library, args.index)
+
+    if args.command == "index":
+        return 0 if __update_library_index(index) else 1
+
+    if args.update:
+        __update_library_index(index)
+    try:
+        entries = index.query(args.bones, args.type, args.frames, args.magic)
+    except (AnimationError, ValueError) as e:
+        print(f"Invalid query -> {str(e)}")
+        return 1
+    for entry in entries:
+        print(index.get_file_path(entry))
+    print(f"{len(entries)} of {index.get_entry_count()} animations found")
+    return 0
+
+
+def __run_store_command(args: argparse.Namespace) -> int:
+    """
+    Run the archive or extract command
+    :param args: Parsed command line arguments
+    :return: the exit code
+    """
+    if args.command == "extract" and not os.path.isdir(args.store):
+        print(f"{args.store} is not a directory")
+        return 1
+    store = SegmentStore(args.store)
+
+    errors = []
+    if args.command == "archive":
+        # Each file is named after its path relative to the argument it was found from. Arguments with the same layout
+        # give the same names: a name is never taken twice in a run, nor (without --replace) taken from the store
+        named_file_paths = expand_relative_paths(args.paths)
+        file_paths = list(named_file_paths)
+        archived_names = {}
+        for i, file_path in enumerate(file_paths):
+            name = named_file_paths[file_path]
+            if name in archived_names or (not args.replace and store.contains(name)):
+                taken_by = archived_names[name] if name in archived_names \
+                    else "an animation of the store (see --replace)"
+                errors.append((file_path, f"the name {name} is already taken by {taken_by}"))
+                print(f"[{i + 1}/{len(file_paths)}] {file_path}: ERROR {errors[-1][1]}")
+                continue
+            try:
+                added_size = store.put(name, load_animation(file_path))
+                archived_names[name] = file_path
+                print(f"[{i + 1}/{len(file_paths)}] {name}: {added_size} new bytes stored")
+            except (OSError, ValueError, AnimationError) as e:
+                errors.append((file_path, f"{type(e).__name__}: {e}"))
+                print(f"[{i + 1}/{len(file_paths)}] {file_path}: ERROR {errors[-1][1]}")
+        stats = store.get_stats()
+        print(f"Done! {stats['animations']} animations in the store, {stats['stored_size']} bytes of bone animations "
+              f"stored for {stats['logical_size']} bytes used, {len(errors)} errors")
+    else:
+        names = args.names or store.get_names()
+        for i, name in enumerate(names):
+            try:
+                out_file_path = os.path.join(args.output_dir, *name.split("/"))
+                os.makedirs(os.path.dirname(out_file_path), exist_ok=True)
+                store.export(name, out_file_path)
+                print(f"[{i + 1}/{len(names)}] {name} -> {out_file_path}")
+            except (OSError, KeyError, ValueError) as e:
+                errors.append((name, f"{type(e).__name__}: {e}"))
+                print(f"[{i + 1}/{len(names)}] {name}: ERROR {errors[-1][1]}")
+        print(f"Done! {len(names) - len(errors)} animations rebuilt, {len(errors)} errors")
+    return 1 if len(errors) > 0 else 0
+
+
+BATCH_COMMANDS = ("info", "validate", "scale", "reduce", "slice", "concat", "chain", "mix", "diff", "patch", "index",
+                  "query", "archive", "extract")
+
+
 def main():
     """
     Script entrypoint
     """
+    # In a frozen executable (py2exe), the worker processes of the batch mode run this script too: they must not get to
+    # the argument parsing
+    multiprocessing.freeze_support()
+
+    # Batch mode
+    if len(sys.argv) > 1 and (sys.argv[1] in BATCH_COMMANDS or sys.argv[1].startswith("-")):
+        sys.exit(__run_batch(sys.argv[1:]))
+
     print(LOGO)
 
     # If a file path is present as a command line argument, load the animation
@@ -248,6 +808,19 @@ def main():
         elif cmd["name"] == "mix":
             __mix_animations()
             __print_animation_info()
+        elif cmd["name"] == "reduce":
+            __reduce_keyframes()
+        elif cmd["name"] == "undo":
+            __undo()
+            __print_animation_info()
+        elif cmd["name"] == "redo":
+            __redo()
+            __print_animation_info()
+        elif cmd["name"] == "revert":
+            __revert_animation()
+            __print_animation_info()
+        elif cmd["name"] == "print_history":
+            __print_history()
         elif cmd["name"] == "save":
             __save_animation()
         elif cmd["name"] == "quit":
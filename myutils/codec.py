@@ -0,0 +1,92 @@
+"""
+This module offers a codec layer for little-endian binary data (like BT3 files), that gives the same results on every
+host.
+Formats are the ones of the struct module, without the byte order character: "<" is always added. The compiled
+struct.Struct of each format is cached, so formats are parsed only once.
+Many values of the same type are handled at once with arrays (type codes of the array module).
+"""
+
+
+import sys
+import struct
+from array import array
+from functools import lru_cache
+
+
+BYTE_ORDER = "<"
+
+# If False, arrays have to be byte-swapped to or from their binary form
+NATIVE_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+@lru_cache(maxsize=None)
+def get_struct(fmt: str) -> struct.Struct:
+    """
+    :param fmt: Format (without byte order character)
+    :return: the (cached) little-endian struct.Struct of fmt
+    """
+    return struct.Struct(BYTE_ORDER + fmt)
+
+
+def pack(fmt: str, *values) -> bytes:
+    return get_struct(fmt).pack(*values)
+
+
+def pack_into(fmt: str, buffer, offset: int, *values):
+    get_struct(fmt).pack_into(buffer, offset, *values)
+
+
+def unpack(fmt: str, buffer, offset: int = 0) -> tuple:
+    return get_struct(fmt).unpack_from(buffer, offset)
+
+
+def iter_unpack(fmt: str, buffer):
+    """
+    :return: an iterator over the values of consecutive blocks of buffer (eg. keyframes), each one a tuple
+    """
+    return get_struct(fmt).iter_unpack(buffer)
+
+
+def from_little_endian(values: array) -> array:
+    """
+    Fix, in place, an array filled with little-endian binary data (eg. by frombytes(...) or through a memoryview)
+    :return: values
+    """
+    if not NATIVE_LITTLE_ENDIAN:
+        values.byteswap()
+    return values
+
+
+def to_little_endian(values: array) -> array:
+    """
+    :return: an array whose binary form (eg. seen through a memoryview) is the little-endian one of values: values
+             itself on little-endian hosts, a byte-swapped copy otherwise
+    """
+    if NATIVE_LITTLE_ENDIAN:
+        return values
+    values = array(values.typecode, values)
+    values.byteswap()
+    return values
+
+
+def pack_many(type_code: str, values) -> bytes:
+    """
+    :param type_code: Type of the values (see the array module)
+    :param values: Values to pack
+    :return: the little-endian binary form of the values, one after the other
+    """
+    values = array(type_code, values)
+    if not NATIVE_LITTLE_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_many(type_code: str, buffer) -> array:
+    """
+    :param type_code: Type of the values (see the array module)
+    :param buffer: Little-endian binary form of the values, one after the other
+    :return: the values (array of type_code)
+    """
+    values = array(type_code)
+    values.frombytes(buffer)
+    return from_little_endian(values)
@@ -2,47 +2,49 @@
 This module offers some quick wrappers for struct.pack(...) and struct.unpack(...).
 p8(...), p16(...), etc  -->  pack values in a little-endian byte, short, etc
 up8(...), up16(...), etc  -->  do the opposite
+The formats are compiled once (see myutils.codec). To pack or unpack many values, use the array functions of
+myutils.codec instead.
 """
 
 
-import struct
+from myutils import codec
 
 
 def p8(value: int) -> bytes:
-    return struct.pack("B", value)
+    return codec.pack("B", value)
 
 
 def p16(value: int) -> bytes:
-    return struct.pack("H", value)
+    return codec.pack("H", value)
 
 
 def p32(value: int) -> bytes:
-    return struct.pack("I", value)
+    return codec.pack("I", value)
 
 
 def p64(value: int) -> bytes:
-    return struct.pack("Q", value)
+    return codec.pack("Q", value)
 
 
 def p_float(value: float) -> bytes:
-    return struct.pack("f", value)
+    return codec.pack("f", value)
 
 
 def up8(what: bytes) -> int:
-    return struct.unpack("B", what)[0]
+    return codec.get_struct("B").unpack(what)[0]
 
 
 def up16(what: bytes) -> int:
-    return struct.unpack("H", what)[0]
+    return codec.get_struct("H").unpack(what)[0]
 
 
 def up32(what: bytes) -> int:
-    return struct.unpack("I", what)[0]
+    return codec.get_struct("I").unpack(what)[0]
 
 
 def up64(what: bytes) -> int:
-    return struct.unpack("Q", what)[0]
+    return codec.get_struct("Q").unpack(what)[0]
 
 
 def up_float(what: bytes) -> float:
-    return struct.unpack("f", what)[0]
+    return codec.get_struct("f").unpack(what)[0]